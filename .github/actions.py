@@ -1,34 +1,29 @@
 import os
-import copy
+import hashlib
+import json
 import re
 import shutil
 import sys
-
-from bs4 import BeautifulSoup
+import tarfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.parser import BytesHeaderParser
 
 # Add the .github directory to path to import download_release
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
-from download_release import download_package_files
+from download_release import (
+    NOT_FOUND, SOURCE_FETCHERS, classify_error, download_package_files, sha256_file
+)
+from manifest import files_by_name, load_manifest, save_manifest
+from metrics import report
+from render import PACKAGES_DIR, SIMPLE_DIR, render_site
 
 
-INDEX_FILE = "index.html"
-TEMPLATE_FILE = "pkg_template.html"
 YAML_ACTION_FILES = [".github/workflows/delete.yml", ".github/workflows/update.yml"]
-PACKAGES_DIR = "packages"
-
-INDEX_CARD_HTML = '''
-<a class="card" href="">
-    placeholder_name
-    <span>
-    </span>
-    <span class="version">
-        placehholder_version
-    </span>
-    <br/>
-    <span class="description">
-        placeholder_description
-    </span>
-</a>'''
+
+# Downloads are network bound, a few of them can run at once
+DOWNLOAD_WORKERS = 8
 
 
 def normalize(name):
@@ -41,223 +36,287 @@ def normalize_version(version):
     return version[1:] if version.startswith("v") else version
 
 
-def is_stable(version):
-    return not ("dev" in version or "a" in version or "b" in version or "rc" in version)
+def read_core_metadata(dist_path):
+    """
+    Read the core metadata of a distribution file: the ``*.dist-info/METADATA``
+    member of a wheel, or the top-level ``PKG-INFO`` of a sdist.
 
+    Returns:
+        raw metadata bytes, or None if the file has none
+    """
+    if dist_path.endswith(".whl"):
+        with zipfile.ZipFile(dist_path) as wheel:
+            for name in wheel.namelist():
+                if name.count("/") == 1 and name.endswith(".dist-info/METADATA"):
+                    return wheel.read(name)
+    elif dist_path.endswith(".tar.gz"):
+        with tarfile.open(dist_path) as sdist:
+            # PKG-INFO is usually one of the first members, stop as soon as
+            # we see it
+            for member in sdist:
+                if member.name.count("/") == 1 and member.name.endswith("/PKG-INFO"):
+                    return sdist.extractfile(member).read()
+    return None
+
+
+def write_core_metadata(wheel_path, metadata):
+    """
+    Store the core metadata of a wheel next to it, as ``<wheel>.metadata``, so
+    installers can read the dependencies without downloading the wheel
+    (PEP 658 / PEP 714).
 
-def package_exists(soup, package_name):
-    package_ref = package_name + "/"
-    for anchor in soup.find_all('a'):
-        if anchor['href'] == package_ref:
-            return True
-    return False
+    Returns:
+        sha256 hex digest of the metadata file
+    """
+    with open(f"{wheel_path}.metadata", "wb") as f:
+        f.write(metadata)
+    return hashlib.sha256(metadata).hexdigest()
 
 
-def transform_github_url(input_url):
-    # Split the input URL to extract relevant information
-    parts = input_url.rstrip('/').split('/')
-    username, repo = parts[-2], parts[-1]
+def upload_time_now():
+    """ Current time, in the PEP 700 upload-time format """
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
 
-    # Create the raw GitHub content URL
-    raw_url = f'https://raw.githubusercontent.com/{username}/{repo}/main/README.md'
-    return raw_url
 
+def file_record(file_path, sha256=None, upload_time=None):
+    """
+    Describe a stored distribution file for the manifest. The core metadata
+    sidecar of wheels is written on the way.
 
-def get_package_links(norm_pkg_name, norm_version, version, package_files):
+    Args:
+        file_path: Path of the stored file
+        sha256: Its digest, if already known (computed otherwise)
+        upload_time: When it was first published (defaults to now)
     """
-    Generate HTML links for package files.
-    
-    Returns:
-        String containing HTML anchor elements for wheel and/or tar.gz files
+    record = {
+        "filename": os.path.basename(file_path),
+        "sha256": sha256 or sha256_file(file_path),
+        "size": os.path.getsize(file_path),
+        "upload_time": upload_time or upload_time_now(),
+    }
+
+    metadata = read_core_metadata(file_path)
+    if metadata is not None:
+        if file_path.endswith(".whl"):
+            record["core_metadata_sha256"] = write_core_metadata(file_path, metadata)
+        requires_python = BytesHeaderParser().parsebytes(metadata).get("Requires-Python")
+        if requires_python:
+            record["requires_python"] = requires_python.strip()
+    return record
+
+
+def version_record(package, version, package_files):
+    """
+    Build the manifest record of a version, from the files downloaded (or
+    built) for it.
+
+    Args:
+        package: Manifest record of the package, used to keep the upload time
+            of files that are already published
+        version: Version (tag) of the package
+        package_files: Result of `download_package_files()`
+    """
+    known_files = files_by_name(package) if package else {}
+    hashes = package_files.get('sha256', {})
+    files = []
+    for path in dist_files(package_files):
+        known = known_files.get(os.path.basename(path), {})
+        files.append(file_record(path, hashes.get(path), known.get("upload_time")))
+    record = {
+        "version": version,
+        "norm_version": normalize_version(version),
+        "files": files,
+    }
+    if package_files.get('tag'):
+        record["tag"] = package_files['tag']
+    return record
+
+
+def dist_files(package_files):
+    """ Paths of all the distribution files of a version, wheels first """
+    files = package_files.get('files') or [package_files.get('wheel'), package_files.get('tar_gz')]
+    return sorted(
+        {path for path in files if path},
+        key=lambda path: (not path.endswith('.whl'), os.path.basename(path))
+    )
+
+
+def download_version(homepage, version, pkg_name, norm_pkg_name, source_fetch=None):
+    """
+    Download (or build) the files of a version, falling back to git URLs when
+    there is nothing to download nor build. Any other error (network errors
+    left after retrying, a failing build) is raised, failing the action.
     """
-    links = []
-    base_url = f"../packages/{norm_pkg_name}/"
-    
-    if package_files.get('wheel'):
-        wheel_filename = os.path.basename(package_files['wheel'])
-        links.append(f'<a href="{base_url}{wheel_filename}">{norm_version}</a>')
-    elif package_files.get('tar_gz'):
-        tar_filename = os.path.basename(package_files['tar_gz'])
-        links.append(f'<a href="{base_url}{tar_filename}">{norm_version}</a>')
-    else:
-        # Fallback to git URL (without egg parameter)
-        return f'<a href="git+{package_files.get("homepage", "")}@{version}">{norm_version}</a>'
-    
-    # Return just the first link for single version display
-    return links[0] if links else ""
-
-
-def register(pkg_name, version, author, short_desc, homepage):
-    long_desc = transform_github_url(homepage)
-    # Read our index first
-    with open(INDEX_FILE) as html_file:
-        soup = BeautifulSoup(html_file, "html.parser")
-    norm_pkg_name = normalize(pkg_name)
-    norm_version = normalize_version(version)
-
-    if package_exists(soup, norm_pkg_name):
-        raise ValueError(f"Package {norm_pkg_name} seems to already exists")
-
-    # Download package files
     package_output_dir = os.path.join(PACKAGES_DIR, norm_pkg_name)
     print(f"Downloading package files for {pkg_name} v{version}")
     try:
-        package_files = download_package_files(
-            homepage, version, pkg_name, package_output_dir
+        return download_package_files(
+            homepage, version, pkg_name, package_output_dir, source_fetch
         )
     except Exception as e:
+        if classify_error(e) != NOT_FOUND:
+            raise
         print(f"Warning: Could not download package files: {e}")
         # Continue with git URL fallback
-        package_files = {'homepage': homepage}
-
-    # Create a new anchor element for our new package
-    placeholder_card = BeautifulSoup(INDEX_CARD_HTML, 'html.parser')
-    placeholder_card = placeholder_card.find('a')
-    new_package = copy.copy(placeholder_card)
-    new_package['href'] = f"{norm_pkg_name}/"
-    new_package.contents[0].replace_with(pkg_name)
-    spans = new_package.find_all('span')
-    spans[1].string = norm_version  # First span contain the version
-    spans[2].string = short_desc    # Second span contain the short description
-
-    # Add it to our index and save it
-    soup.find('h6', class_='text-header').insert_after(new_package)
-    with open(INDEX_FILE, 'wb') as index:
-        index.write(soup.prettify("utf-8"))
-
-    # Then get the template, replace the content and write to the right place
-    with open(TEMPLATE_FILE) as temp_file:
-        template = temp_file.read()
-
-    # Generate package links HTML
-    package_links = get_package_links(norm_pkg_name, norm_version, version, package_files)
-
-    template = template.replace("_package_name", pkg_name)
-    template = template.replace("_norm_version", norm_version)
-    template = template.replace("_version", version)
-    template = template.replace("_link", package_links)
-    template = template.replace("_homepage", homepage)
-    template = template.replace("_author", author)
-    template = template.replace("_long_description", long_desc)
-    template = template.replace("_latest_main", version)
-
-    os.mkdir(norm_pkg_name)
-    package_index = os.path.join(norm_pkg_name, INDEX_FILE)
-    with open(package_index, "w") as f:
-        f.write(template)
+        return {'homepage': homepage}
 
 
-def update(pkg_name, version):
-    # Read our index first
-    with open(INDEX_FILE) as html_file:
-        soup = BeautifulSoup(html_file, "html.parser")
-    norm_pkg_name = normalize(pkg_name)
-    norm_version = normalize_version(version)
-
-    if not package_exists(soup, norm_pkg_name):
-        raise ValueError(f"Package {norm_pkg_name} seems to not exists")
-
-    # Change the version in the main page (only if stable)
-    if is_stable(version):
-        anchor = soup.find('a', attrs={"href": f"{norm_pkg_name}/"})
-        spans = anchor.find_all('span')
-        spans[1].string = norm_version
-        with open(INDEX_FILE, 'wb') as index:
-            index.write(soup.prettify("utf-8"))
-
-    # Change the package page
-    index_file = os.path.join(norm_pkg_name, INDEX_FILE) 
-    with open(index_file) as html_file:
-        soup = BeautifulSoup(html_file, "html.parser")
-        
-    # Extract the URL from the onclick attribute
-    button = soup.find('button', id='repoHomepage')
-    if button:
-        homepage = button.get("onclick")[len("openLinkInNewTab('"):-2]
-    else:
-        raise Exception("Homepage URL not found")
+def apply_register(manifest, op, package_files):
+    package = {
+        "name": op["pkg_name"],
+        "author": op["author"],
+        "short_desc": op["short_desc"],
+        "homepage": op["homepage"],
+        "versions": [version_record(None, op["version"], package_files)],
+    }
+    if op.get("source_fetch"):
+        package["source_fetch"] = op["source_fetch"]
+    manifest["packages"][normalize(op["pkg_name"])] = package
 
-    # Download package files for this version
-    package_output_dir = os.path.join(PACKAGES_DIR, norm_pkg_name)
-    print(f"Downloading package files for {pkg_name} v{version}")
-    try:
-        package_files = download_package_files(
-            homepage, version, pkg_name, package_output_dir
-        )
-    except Exception as e:
-        print(f"Warning: Could not download package files: {e}")
-        # Continue with git URL fallback
-        package_files = {'homepage': homepage}
-
-    # Create a new div element for our new version
-    original_div = soup.find('section', class_='versions').findAll('div')[-1]
-    new_div = copy.copy(original_div)
-    anchor = new_div.find('a')
-    new_div['onclick'] = f"load_readme('{version}', scroll_to_div=true);"
-    new_div['id'] = version
-    new_div['class'] = ""
-    if not is_stable(version):
-        new_div['class'] += "prerelease"
-    else:
-        # replace the latest main version
-        main_version_span = soup.find('span', id='latest-main-version')
-        main_version_span.string = version
-    
-    # Clear the anchor and add new links
-    anchor.clear()
-    anchor.string = norm_version
-    
-    # Generate package links for this version
-    base_url = f"../packages/{norm_pkg_name}/"
-    if package_files.get('wheel'):
-        wheel_filename = os.path.basename(package_files['wheel'])
-        anchor['href'] = f"{base_url}{wheel_filename}"
-        anchor['title'] = wheel_filename
-    elif package_files.get('tar_gz'):
-        tar_filename = os.path.basename(package_files['tar_gz'])
-        anchor['href'] = f"{base_url}{tar_filename}"
-        anchor['title'] = tar_filename
+
+def apply_update(manifest, op, package_files):
+    package = manifest["packages"][normalize(op["pkg_name"])]
+    package["versions"].append(version_record(package, op["version"], package_files))
+
+
+def apply_delete(manifest, op, package_files):
+    del manifest["packages"][normalize(op["pkg_name"])]
+
+
+OPERATIONS = {
+    "REGISTER": apply_register,
+    "UPDATE": apply_update,
+    "DELETE": apply_delete,
+}
+
+
+def plan_batch(manifest, operations):
+    """
+    Check a batch of operations against the manifest, without changing it.
+
+    Returns:
+        tuple: (downloads, deleted) - the (homepage, version, pkg_name,
+        norm_pkg_name, source_fetch) of every version to download, by
+        operation index, and the normalized names of the packages deleted by
+        the batch
+    """
+    sources = {
+        name: (package["homepage"], package.get("source_fetch"))
+        for name, package in manifest["packages"].items()
+    }
+    downloads = {}
+    deleted = set()
+
+    for i, op in enumerate(operations):
+        action = op["action"]
+        norm_pkg_name = normalize(op["pkg_name"])
+        if action not in OPERATIONS:
+            raise ValueError(f"Unknown action '{action}'")
+
+        if action == "REGISTER":
+            if norm_pkg_name in sources:
+                raise ValueError(f"Package {norm_pkg_name} seems to already exists")
+            if op.get("source_fetch") and op["source_fetch"] not in SOURCE_FETCHERS:
+                raise ValueError(f"Unknown source fetch mode '{op['source_fetch']}'")
+            sources[norm_pkg_name] = (op["homepage"], op.get("source_fetch"))
+        elif norm_pkg_name not in sources:
+            raise ValueError(f"Package '{norm_pkg_name}' seems to not exists")
+
+        if action == "DELETE":
+            del sources[norm_pkg_name]
+            deleted.add(norm_pkg_name)
+        else:
+            homepage, source_fetch = sources[norm_pkg_name]
+            downloads[i] = (homepage, op["version"], op["pkg_name"], norm_pkg_name, source_fetch)
+
+    return downloads, deleted
+
+
+def run_batch(operations, workers=DOWNLOAD_WORKERS):
+    """
+    Apply a batch of register / update / delete operations to the index : the
+    whole batch is checked first, every version is downloaded concurrently,
+    the changes are applied to the manifest in memory and each affected page
+    is written once at the end.
+
+    Args:
+        operations: List of dicts with an `action` (REGISTER, UPDATE or
+            DELETE), a `pkg_name`, and the other arguments of the action
+            (`version`, `author`, `short_desc`, `homepage`)
+        workers: Number of concurrent downloads
+    """
+    # Read our manifest first
+    manifest = load_manifest()
+    operations = [dict(op, action=op["action"].upper()) for op in operations]
+    downloads, deleted = plan_batch(manifest, operations)
+
+    # Remove the directories of deleted packages before downloading, so a
+    # package deleted then registered again starts from a clean slate
+    for norm_pkg_name in sorted(deleted):
+        for directory in (norm_pkg_name, os.path.join(PACKAGES_DIR, norm_pkg_name),
+                          os.path.join(SIMPLE_DIR, norm_pkg_name)):
+            if os.path.exists(directory):
+                shutil.rmtree(directory)
+
+    # Download every version at once
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {i: executor.submit(download_version, *args) for i, args in downloads.items()}
+        package_files = {i: future.result() for i, future in futures.items()}
+
+    # Record everything in the manifest, in order
+    for i, op in enumerate(operations):
+        OPERATIONS[op["action"]](manifest, op, package_files.get(i))
+    save_manifest(manifest)
+
+    # Then render the pages from it, once
+    render_site(manifest)
+
+
+def read_batch(path):
+    """
+    Read a batch of operations from a file ('-' for stdin) : either a JSON
+    list, or one JSON object per line.
+    """
+    if path == "-":
+        content = sys.stdin.read()
     else:
-        # Fallback to git URL without egg parameter
-        anchor['href'] = f"git+{homepage}@{version}"
+        with open(path) as f:
+            content = f.read()
+    if content.lstrip().startswith("["):
+        return json.loads(content)
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
 
-    # Add it to our index
-    original_div.insert_after(new_div)
+def register(pkg_name, version, author, short_desc, homepage, source_fetch=None):
+    run_batch([{
+        "action": "REGISTER", "pkg_name": pkg_name, "version": version,
+        "author": author, "short_desc": short_desc, "homepage": homepage,
+        "source_fetch": source_fetch,
+    }])
 
-    # Change the latest version (if stable)
-    if is_stable(version):
-        soup.html.body.div.section.find_all('span')[1].contents[0].replace_with(version)
 
-    # Save it
-    with open(index_file, 'wb') as index:
-        index.write(soup.prettify("utf-8"))
+def update(pkg_name, version):
+    run_batch([{"action": "UPDATE", "pkg_name": pkg_name, "version": version}])
 
 
 def delete(pkg_name):
-    # Read our index first
-    with open(INDEX_FILE) as html_file:
-        soup = BeautifulSoup(html_file, "html.parser")
-    norm_pkg_name = normalize(pkg_name)
+    run_batch([{"action": "DELETE", "pkg_name": pkg_name}])
 
-    if not package_exists(soup, norm_pkg_name):
-        raise ValueError(f"Package '{norm_pkg_name}' seems to not exists")
 
-    # Remove the package directory
-    shutil.rmtree(norm_pkg_name)
-    
-    # Remove the package files directory if it exists
-    package_files_dir = os.path.join(PACKAGES_DIR, norm_pkg_name)
-    if os.path.exists(package_files_dir):
-        shutil.rmtree(package_files_dir)
+def main():
+    try:
+        run_action()
+    finally:
+        # Report where the time went, even when the action failed
+        report()
 
-    # Find and remove the anchor corresponding to our package
-    anchor = soup.find('a', attrs={"href": f"{norm_pkg_name}/"})
-    anchor.extract()
-    with open(INDEX_FILE, 'wb') as index:
-        index.write(soup.prettify("utf-8"))
 
+def run_action():
+    # A batch of operations, from a file or stdin
+    if len(sys.argv) == 3 and sys.argv[1] == "--batch":
+        run_batch(read_batch(sys.argv[2]))
+        return
 
-def main():
     # Call the right method, with the right arguments
     action = os.environ["PKG_ACTION"]
 
@@ -268,6 +327,7 @@ def main():
             author=os.environ["PKG_AUTHOR"],
             short_desc=os.environ["PKG_SHORT_DESC"],
             homepage=os.environ["PKG_HOMEPAGE"],
+            source_fetch=os.environ.get("PKG_SOURCE_FETCH"),
         )
     elif action == "DELETE":
         delete(
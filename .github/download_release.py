@@ -5,139 +5,1309 @@ Falls back to building from source if wheels are not available.
 """
 
 import os
+import base64
+import hashlib
+try:
+    import fcntl
+except ImportError:  # Windows
+    pass
+import re
+import http.client
+import io
 import json
-import urllib.request
+import random
+import socket
+import threading
+import time
+import urllib.parse
 import urllib.error
+import urllib.request
 import tarfile
 import zipfile
 import shutil
 import subprocess
+import sys
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from metrics import record, timed
+
+
+CHUNK_SIZE = 1024 * 1024
+
+# Retries of a request failing with a transient error, and their backoff
+# (doubled on each retry, with jitter) in seconds
+MAX_RETRIES = 4
+BACKOFF_BASE = 1
+BACKOFF_MAX = 30
+# Files of a release downloaded at once
+DOWNLOAD_THREADS = 4
+
+USER_AGENT = 'MIT-Kavli-PyPi'
+# Seconds to wait for a connection, or for data on it
+TIMEOUT = 30
+MAX_REDIRECTS = 5
+REDIRECT_CODES = (301, 302, 303, 307, 308)
 
-def get_release_assets(repo_url, version):
+
+class Response:
     """
-    Fetch release assets from GitHub API.
-    
-    Args:
-        repo_url: GitHub repository URL (e.g., https://github.com/user/repo)
-        version: Version tag (e.g., v1.0.0 or 1.0.0)
-    
-    Returns:
-        List of asset dictionaries with download URLs
+    Response of an `HTTPSession` request. Its connection goes back to the
+    pool once the body is fully read and the response closed.
     """
-    # Extract owner and repo from URL
-    parts = repo_url.rstrip('/').split('/')
-    owner, repo = parts[-2], parts[-1]
-    
-    # Try with and without 'v' prefix
-    versions_to_try = [version]
-    if not version.startswith('v'):
-        versions_to_try.append(f'v{version}')
-    if version.startswith('v'):
-        versions_to_try.append(version[1:])
-    
-    for v in versions_to_try:
-        api_url = f"https://api.github.com/repos/{owner}/{repo}/releases/tags/{v}"
-        
+
+    def __init__(self, session, key, connection, response, url):
+        self.session = session
+        self.key = key
+        self.connection = connection
+        self.response = response
+        self.url = url
+        self.status = response.status
+        self.headers = response.headers
+        # Number of redirects followed to get it
+        self.redirects = 0
+
+    @property
+    def length(self):
+        """Number of bytes of the body not read yet (None if unknown)."""
+        return self.response.length
+
+    def read(self, amt=None):
+        return self.response.read(amt)
+
+    def close(self):
+        if self.connection is None:
+            return
+        reusable = self.response.isclosed() and not self.response.will_close
+        self.response.close()
+        if reusable:
+            self.session.release(self.key, self.connection)
+        else:
+            self.connection.close()
+        self.connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class HTTPSession:
+    """
+    Minimal HTTP client keeping a pool of keep-alive connections per host, so
+    the API calls and the downloads (and the redirects between them) reuse
+    their TLS connections. It is safe to share between threads.
+
+    Like `urlopen`, it goes through the proxies of the environment
+    (`HTTPS_PROXY`, `HTTP_PROXY`, `NO_PROXY`), tunneling HTTPS with CONNECT,
+    and raises errors as `urllib.error.HTTPError`.
+    """
+
+    def __init__(self, timeout=TIMEOUT, user_agent=USER_AGENT):
+        self.timeout = timeout
+        self.user_agent = user_agent
+        self.proxies = urllib.request.getproxies()
+        self.pools = {}
+        self.lock = threading.Lock()
+
+    def proxy(self, scheme, host):
+        """The proxy to reach a host through (split URL), or None."""
+        proxy = self.proxies.get(scheme)
+        if not proxy or urllib.request.proxy_bypass(host):
+            return None
+        if '://' not in proxy:
+            proxy = 'http://' + proxy
+        return urllib.parse.urlsplit(proxy)
+
+    def connect(self, key):
+        scheme, host, port = key
+        connection_class = (
+            http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        )
+        proxy = self.proxy(scheme, host)
+        if proxy is None:
+            connection = connection_class(host, port, timeout=self.timeout)
+            connection.proxy_headers = None
+            return connection
+
+        proxy_headers = {}
+        if proxy.username:
+            credentials = urllib.parse.unquote(proxy.username)
+            credentials += ':' + urllib.parse.unquote(proxy.password or '')
+            proxy_headers['Proxy-Authorization'] = (
+                'Basic ' + base64.b64encode(credentials.encode()).decode()
+            )
+        connection = connection_class(proxy.hostname, proxy.port, timeout=self.timeout)
+        if scheme == 'https':
+            # TLS with the host itself, through a CONNECT tunnel
+            connection.set_tunnel(host, port, headers=proxy_headers)
+            connection.proxy_headers = None
+        else:
+            # The proxy forwards requests for absolute URLs
+            connection.proxy_headers = proxy_headers
+        return connection
+
+    def acquire(self, key):
+        with self.lock:
+            pool = self.pools.setdefault(key, [])
+            if pool:
+                return pool.pop(), True
+        return self.connect(key), False
+
+    def release(self, key, connection):
+        with self.lock:
+            self.pools.setdefault(key, []).append(connection)
+
+    def close(self):
+        with self.lock:
+            pools, self.pools = self.pools, {}
+        for pool in pools.values():
+            for connection in pool:
+                connection.close()
+
+    def send(self, method, url, headers):
+        parsed = urllib.parse.urlsplit(url)
+        key = (parsed.scheme, parsed.hostname, parsed.port)
+        path = urllib.parse.urlunsplit(('', '', parsed.path or '/', parsed.query, ''))
+
+        while True:
+            connection, reused = self.acquire(key)
+            try:
+                if connection.proxy_headers is None:
+                    connection.request(method, path, headers=headers)
+                else:
+                    connection.request(
+                        method, url, headers={**headers, **connection.proxy_headers}
+                    )
+                return Response(self, key, connection, connection.getresponse(), url)
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+                # The server closed an idle connection, try again on a new one
+                if not reused:
+                    raise
+            except BaseException:
+                connection.close()
+                raise
+
+    def request(self, method, url, headers=None):
+        """
+        Send a request, following redirects.
+
+        Returns:
+            Response: to be closed (or used as a context manager)
+        """
+        origin = urllib.parse.urlsplit(url).hostname
+        headers = {'User-Agent': self.user_agent, **(headers or {})}
+
+        for redirects in range(MAX_REDIRECTS + 1):
+            response = self.send(method, url, headers)
+            response.redirects = redirects
+            if response.status not in REDIRECT_CODES:
+                break
+            location = response.headers['Location']
+            response.read()
+            response.close()
+            url = urllib.parse.urljoin(url, location)
+            if response.status == 303:
+                method = 'GET'
+            # Never leak credentials to another host
+            if urllib.parse.urlsplit(url).hostname != origin:
+                headers.pop('Authorization', None)
+        else:
+            raise urllib.error.URLError(f"Too many redirects for {url}")
+
+        if response.status >= 400:
+            # Read the (small) error body, so the connection can be reused
+            body = response.read()
+            response.close()
+            raise urllib.error.HTTPError(
+                url, response.status, response.response.reason, response.headers,
+                io.BytesIO(body)
+            )
+        return response
+
+    def get(self, url, headers=None):
+        return self.request('GET', url, headers)
+
+
+# Shared by every network call of the actions
+SESSION = HTTPSession()
+
+# GitHub API, and the token to authenticate to it (5000 requests per hour
+# instead of 60)
+API_URL = os.environ.get('GITHUB_API_URL', 'https://api.github.com')
+GITHUB_TOKEN = os.environ.get('GITHUB_TOKEN') or os.environ.get('GH_TOKEN')
+# Below this number of remaining API requests, they are spread until the reset
+THROTTLE_BELOW = 10
+# Longest pause accepted to wait for the rate limit to reset, in seconds
+MAX_PAUSE = 15 * 60
+RATE_LIMIT_RETRIES = 3
+
+
+class RateLimiter:
+    """
+    Keep track of the GitHub API budget from the `X-RateLimit-*` headers of
+    its responses, and hold requests back to stay within it : requests are
+    spread out until the reset when few are left, and paused until the reset
+    (or for `Retry-After`) when the limit is hit.
+    """
+
+    def __init__(self):
+        self.limit = None
+        self.remaining = None
+        self.reset = None
+        self.lock = threading.Lock()
+
+    def update(self, headers):
+        """Record the budget given by the headers of a response."""
+        if headers.get('X-RateLimit-Remaining') is None:
+            return
+        with self.lock:
+            self.limit = int(headers.get('X-RateLimit-Limit', 0)) or self.limit
+            self.remaining = int(headers['X-RateLimit-Remaining'])
+            self.reset = float(headers.get('X-RateLimit-Reset', 0)) or self.reset
+        print(f"GitHub API budget: {self.budget()}")
+
+    def budget(self):
+        if self.remaining is None:
+            return "unknown"
+        resets_in = max(0, int(self.reset - time.time())) if self.reset else 0
+        limit = f"/{self.limit}" if self.limit else ""
+        return f"{self.remaining}{limit} requests left, reset in {resets_in}s"
+
+    def pause(self, seconds, reason):
+        if seconds > MAX_PAUSE:
+            raise RuntimeError(
+                f"GitHub API rate limit exceeded ({self.budget()}), "
+                f"set GITHUB_TOKEN to get a higher limit"
+            )
+        print(f"Pausing {seconds:.0f}s: {reason}")
+        time.sleep(seconds)
+
+    def wait(self):
+        """Wait until a request can be sent."""
+        with self.lock:
+            remaining, reset = self.remaining, self.reset
+            if remaining is not None:
+                # Count the request about to be sent
+                self.remaining = max(0, remaining - 1)
+        if remaining is None or reset is None or remaining >= THROTTLE_BELOW:
+            return
+        time_left = reset - time.time()
+        if time_left <= 0:
+            return
+        if remaining == 0:
+            self.pause(time_left + 1, "GitHub API rate limit reached")
+        else:
+            self.pause(
+                time_left / remaining,
+                f"spreading the {remaining} GitHub API requests left until the reset"
+            )
+
+    def retry_delay(self, error):
+        """
+        Seconds to wait before retrying a request rejected by the rate limit,
+        or None if the error is not a rate limit one.
+        """
+        if error.code not in (403, 429):
+            return None
+        retry_after = error.headers.get('Retry-After')
+        if retry_after is not None:
+            return int(retry_after)
+        if error.headers.get('X-RateLimit-Remaining') == '0':
+            reset = float(error.headers.get('X-RateLimit-Reset', 0))
+            return max(0, reset - time.time()) + 1
+        return None
+
+
+RATE_LIMITER = RateLimiter()
+
+
+def github_request(url, headers):
+    """
+    Send a request to the GitHub API, authenticated with GITHUB_TOKEN (or
+    GH_TOKEN) when set, and within the rate limit.
+    """
+    headers = dict(headers)
+    if GITHUB_TOKEN:
+        headers['Authorization'] = f'Bearer {GITHUB_TOKEN}'
+
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        RATE_LIMITER.wait()
+        try:
+            response = SESSION.get(url, headers)
+        except urllib.error.HTTPError as e:
+            RATE_LIMITER.update(e.headers)
+            delay = RATE_LIMITER.retry_delay(e)
+            if delay is None or attempt == RATE_LIMIT_RETRIES:
+                raise
+            RATE_LIMITER.pause(delay, f"GitHub API rate limit ({e.code})")
+            continue
+        RATE_LIMITER.update(response.headers)
+        return response
+
+
+# Persistent cache of the actions (API responses...), kept between CI runs
+CACHE_DIR = os.environ.get(
+    'PKG_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'mit-kavli-pypi')
+)
+API_CACHE_DIR = os.path.join(CACHE_DIR, 'api')
+# Downloaded files, by sha256, and the size they can take
+BLOB_CACHE_DIR = os.path.join(CACHE_DIR, 'blobs')
+CACHE_MAX_BYTES = int(os.environ.get('PKG_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+CACHE_LOCK = threading.Lock()
+# Files built from source, by build key (see `build_key()`)
+BUILD_CACHE_DIR = os.path.join(CACHE_DIR, 'builds')
+# Interpreters to build wheels for (commands or paths, separated by spaces)
+BUILD_PYTHONS = os.environ.get('PKG_BUILD_PYTHONS', '').split() or [sys.executable]
+# Version (like cpython3.12), full version and resolved executable of each
+# interpreter, by command
+INTERPRETERS = {}
+# Build environments, by requirements, and the wheels they are installed from
+ENV_DIR = os.path.join(CACHE_DIR, 'envs')
+WHEELHOUSE_DIR = os.path.join(CACHE_DIR, 'wheelhouse')
+ENV_LOCKS = {}
+WHEELHOUSE_LOCK = threading.Lock()
+# Build without ever downloading build dependencies
+OFFLINE = bool(os.environ.get('PKG_OFFLINE'))
+# Build requirements of a project without [build-system] (PEP 518)
+DEFAULT_BUILD_REQUIRES = ['setuptools>=40.8.0']
+# Run in a build environment, prints the requirements of the backend (static
+# and dynamic) it lacks to build the distributions given as arguments
+UNMET_REQUIRES_SCRIPT = (
+    'import build, json, sys; builder = build.ProjectBuilder("."); '
+    'print(json.dumps(sorted({unmet[0] for distribution in sys.argv[1:] '
+    'for unmet in builder.check_dependencies(distribution)})))'
+)
+# Bare mirrors of the repositories built with git metadata, and the size
+# they can take
+MIRROR_DIR = os.path.join(CACHE_DIR, 'mirrors')
+MIRROR_MAX_BYTES = int(os.environ.get('PKG_MIRROR_MAX_BYTES', 2 * 1024 ** 3))
+MIRROR_LOCKS = {}
+# Refs fetched into the mirrors : branches and tags only
+MIRROR_REFSPECS = ['+refs/heads/*:refs/heads/*', '+refs/tags/*:refs/tags/*']
+# Mirrors already fetched during this run
+FETCHED_MIRRORS = set()
+# Mirrors used during this run, never pruned by it (their worktrees may be
+# building in another thread)
+USED_MIRRORS = set()
+MIRROR_PRUNE_LOCK = threading.Lock()
+# Build backends (normalized names) computing the version from git
+VCS_VERSIONING_BACKENDS = {
+    'setuptools-scm', 'hatch-vcs', 'versioningit', 'dunamai', 'poetry-dynamic-versioning',
+}
+# ioctl cloning a file on copy-on-write filesystems (btrfs, xfs...)
+FICLONE = 0x40049409
+# Seconds during which a 404 is trusted without asking again
+NEGATIVE_TTL = 6 * 3600
+
+RELEASES_PER_PAGE = 100
+# Release index of each repository, by (owner, repo), for the rest of the run
+RELEASE_INDEXES = {}
+# Held while listing the releases of a repository, by (owner, repo)
+RELEASE_INDEX_LOCKS = {}
+
+
+def api_cache_path(url):
+    return os.path.join(API_CACHE_DIR, hashlib.sha256(url.encode()).hexdigest() + '.json')
+
+
+def load_api_cache(url):
+    try:
+        with open(api_cache_path(url)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_api_cache(url, entry):
+    os.makedirs(API_CACHE_DIR, exist_ok=True)
+    path = api_cache_path(url)
+    # Unique temporary file, as threads may store the same URL at once
+    fd, tmp_path = tempfile.mkstemp(dir=API_CACHE_DIR, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(dict(entry, url=url, time=time.time()), f)
+    os.replace(tmp_path, path)
+
+
+def get_json(url):
+    """
+    GET a JSON document from the GitHub API, through an on-disk cache: cached
+    responses are revalidated with their ETag / Last-Modified (a 304 does not
+    count toward the rate limit) and 404s are remembered for NEGATIVE_TTL.
+
+    Raises:
+        urllib.error.HTTPError: for error responses, including cached 404s
+    """
+    entry = load_api_cache(url)
+    headers = {'Accept': 'application/vnd.github+json'}
+
+    if entry and entry['status'] == 404:
+        if time.time() - entry['time'] < NEGATIVE_TTL:
+            raise urllib.error.HTTPError(url, 404, 'Not Found (cached)', {}, io.BytesIO())
+        entry = None
+    if entry:
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+    with timed('api', url=url, status='error') as event:
         try:
-            with urllib.request.urlopen(api_url) as response:
-                data = json.loads(response.read())
-                return data.get('assets', [])
+            with github_request(url, headers) as response:
+                body = response.read().decode()
+                event['status'] = response.status
+                if response.status == 304 and entry:
+                    return json.loads(entry['body'])
+                save_api_cache(url, {
+                    'status': response.status,
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified'),
+                    'body': body,
+                })
+                return json.loads(body)
         except urllib.error.HTTPError as e:
+            event['status'] = e.code
             if e.code == 404:
-                continue
+                save_api_cache(url, {'status': 404})
             raise
-    
-    raise ValueError(f"No release found for {repo_url} version {version}")
 
 
-def download_file(url, dest_path):
-    """Download a file from URL to destination path."""
+class ReleaseNotFound(ValueError):
+    """The version has no GitHub release."""
+
+
+class DownloadMismatch(ValueError):
+    """A downloaded file does not match the size or digest of its asset."""
+
+
+# Kinds of errors
+TRANSIENT = 'transient'
+PERMANENT = 'permanent'
+NOT_FOUND = 'not-found'
+
+TRANSIENT_STATUS_CODES = (408, 425, 429, 500, 502, 503, 504)
+
+
+def classify_error(error):
+    """
+    Tell whether an error is transient (worth retrying), permanent, or means
+    that what was requested does not exist.
+    """
+    if isinstance(error, urllib.error.HTTPError):
+        if error.code in (404, 410):
+            return NOT_FOUND
+        return TRANSIENT if error.code in TRANSIENT_STATUS_CODES else PERMANENT
+    if isinstance(error, ReleaseNotFound):
+        return NOT_FOUND
+    if isinstance(error, (urllib.error.URLError, ConnectionError, TimeoutError, socket.timeout,
+                          socket.gaierror, http.client.HTTPException, DownloadMismatch)):
+        return TRANSIENT
+    return PERMANENT
+
+
+def with_retries(func, *args):
+    """
+    Call func(*args), retrying it on transient errors (up to MAX_RETRIES
+    times) with an exponential backoff and full jitter.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return func(*args)
+        except Exception as e:
+            if classify_error(e) != TRANSIENT or attempt == MAX_RETRIES:
+                raise
+            delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+            print(f"Transient error ({e!r}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def tag_variants(version):
+    """Tags a version may have been released under: as is, and with or without 'v'."""
+    if version.startswith('v'):
+        return [version, version[1:]]
+    return [version, f'v{version}']
+
+
+def release_index(repo_url):
+    """
+    Index of the releases of a repository, from one paginated listing of its
+    releases (cached on disk, and in memory for the rest of the run).
+
+    Returns:
+        dict: assets of each release, by tag
+    """
+    # Extract owner and repo from URL
+    parts = repo_url.rstrip('/').split('/')
+    owner, repo = parts[-2], parts[-1]
+
+    with RELEASE_INDEX_LOCKS.setdefault((owner, repo), threading.Lock()):
+        if (owner, repo) not in RELEASE_INDEXES:
+            index = {}
+            page = 1
+            while True:
+                releases = with_retries(
+                    get_json,
+                    f"{API_URL}/repos/{owner}/{repo}/releases"
+                    f"?per_page={RELEASES_PER_PAGE}&page={page}"
+                )
+                for release in releases:
+                    if not release.get('draft'):
+                        index[release['tag_name']] = release.get('assets', [])
+                if len(releases) < RELEASES_PER_PAGE:
+                    break
+                page += 1
+            RELEASE_INDEXES[owner, repo] = index
+        return RELEASE_INDEXES[owner, repo]
+
+
+def resolve_release(repo_url, version):
+    """
+    Find the release of a version.
+
+    Args:
+        repo_url: GitHub repository URL (e.g., https://github.com/user/repo)
+        version: Version tag (e.g., v1.0.0 or 1.0.0)
+
+    Returns:
+        tuple: (tag, assets) - the tag of the release, and its asset
+        dictionaries with download URLs
+    """
+    index = release_index(repo_url)
+    for tag in tag_variants(version):
+        if tag in index:
+            return tag, index[tag]
+    raise ReleaseNotFound(f"No release found for {repo_url} version {version}")
+
+
+def sha256_of(path):
+    """Start a sha256 digest with the content of a file on disk."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest
+
+
+def sha256_file(path):
+    """Compute the sha256 hex digest of a file on disk."""
+    return sha256_of(path).hexdigest()
+
+
+def asset_sha256(asset):
+    """sha256 hex digest of a release asset, as published by GitHub (if any)."""
+    digest = asset.get('digest') or ''
+    return digest[len('sha256:'):] if digest.startswith('sha256:') else None
+
+
+def fetch_part(url, part_path):
+    """
+    Download a file into `part_path`, resuming from the bytes already there
+    with a Range request.
+
+    Returns:
+        sha256 hex digest of the whole file
+    """
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = {'Range': f'bytes={offset}-'} if offset else {}
+
+    start = time.perf_counter()
+    try:
+        response = SESSION.get(url, headers)
+    except urllib.error.HTTPError as e:
+        # Nothing left to download : the part is already complete
+        if e.code == 416 and offset:
+            return sha256_file(part_path)
+        raise
+    ttfb = time.perf_counter() - start
+
+    size = 0
+    with response:
+        if offset and response.status == 206:
+            print(f"Resuming {url} from byte {offset}")
+            digest = sha256_of(part_path)
+            mode = 'ab'
+        else:
+            # The server ignored the range, start over
+            digest = hashlib.sha256()
+            mode = 'wb'
+        with open(part_path, mode) as f:
+            for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+        record(
+            'download', url=url, bytes=size, ttfb=round(ttfb, 3),
+            transfer_seconds=round(time.perf_counter() - start - ttfb, 3),
+            redirects=response.redirects, resumed_from=offset if mode == 'ab' else 0
+        )
+        # The connection was closed before the end of the body
+        if response.length:
+            raise http.client.IncompleteRead(b'', response.length)
+
+    return digest.hexdigest()
+
+
+def cache_path(sha256):
+    return os.path.join(BLOB_CACHE_DIR, sha256[:2], sha256)
+
+
+def materialize(src_path, dest_path):
+    """
+    Make a file of the download cache appear at dest_path without copying it
+    when possible: as a hardlink, or else a reflink (copy-on-write clone),
+    or else a plain copy.
+    """
+    tmp_path = f'{dest_path}.part'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(src_path, tmp_path)
+    except OSError:
+        with open(src_path, 'rb') as src, open(tmp_path, 'wb') as dest:
+            try:
+                fcntl.ioctl(dest.fileno(), FICLONE, src.fileno())
+            except (OSError, NameError):
+                shutil.copyfileobj(src, dest, CHUNK_SIZE)
+    os.replace(tmp_path, dest_path)
+
+
+def cache_lookup(sha256, size=None):
+    """Path of the cached file with this digest, or None."""
+    path = cache_path(sha256)
+    if not os.path.exists(path) or (size is not None and os.path.getsize(path) != size):
+        return None
+    # Mark it as recently used
+    os.utime(path)
+    return path
+
+
+def cache_store(path, sha256):
+    """Add a (verified) file to the download cache, then keep it within its size."""
+    cached_path = cache_path(sha256)
+    if os.path.exists(cached_path):
+        os.utime(cached_path)
+        return
+    os.makedirs(os.path.dirname(cached_path), exist_ok=True)
+    materialize(path, cached_path)
+    prune_cache()
+
+
+def prune_cache(max_bytes=CACHE_MAX_BYTES):
+    """Remove the least recently used files of the download cache beyond max_bytes."""
+    with CACHE_LOCK:
+        files = []
+        for directory, _, filenames in os.walk(BLOB_CACHE_DIR):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def download_file(url, dest_path, size=None, sha256=None):
+    """
+    Download a file from URL to destination path.
+
+    The file is written to `<dest_path>.part` and hashed in a single streaming
+    pass. An interrupted transfer is resumed (when retried, or in the next
+    run) from what is already in the part file. The file is only renamed to
+    `dest_path` once complete, and once its size and digest match the
+    expected ones (when given).
+
+    Files are kept in a download cache shared by all runs and packages, keyed
+    by their digest : when the expected digest is known and in the cache, no
+    transfer is needed.
+
+    Returns:
+        sha256 hex digest of the downloaded file
+    """
+    cached_path = cache_lookup(sha256, size) if sha256 else None
+    if cached_path:
+        print(f"Using cached {os.path.basename(dest_path)}")
+        materialize(cached_path, dest_path)
+        record('download', url=url, bytes=os.path.getsize(dest_path), cached=True)
+        return sha256
+
     print(f"Downloading {url}")
-    
-    headers = {'User-Agent': 'MIT-Kavli-PyPi'}
-    request = urllib.request.Request(url, headers=headers)
-    
-    with urllib.request.urlopen(request) as response:
-        with open(dest_path, 'wb') as f:
-            shutil.copyfileobj(response, f)
-    
-    return dest_path
+    part_path = f'{dest_path}.part'
+
+    digest = fetch_part(url, part_path)
+
+    actual_size = os.path.getsize(part_path)
+    if (size is not None and actual_size != size) or (sha256 and digest != sha256):
+        # Corrupt, start from scratch next time
+        os.remove(part_path)
+        raise DownloadMismatch(
+            f"Downloaded {url} does not match the release asset: "
+            f"{actual_size} bytes, sha256 {digest} (expected {size} bytes, sha256 {sha256})"
+        )
+
+    os.replace(part_path, dest_path)
+    cache_store(dest_path, digest)
+    return digest
+
+
+def normalize_name(name):
+    """ From PEP503 : https://www.python.org/dev/peps/pep-0503/ """
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def parse_wheel_filename(filename):
+    """
+    Split a wheel filename into its fields (PEP 427):
+    {distribution}-{version}(-{build tag})?-{python tag}-{abi tag}-{platform tag}.whl
+
+    Returns:
+        dict: the fields, or None if this is not a wheel filename
+    """
+    if not filename.endswith('.whl'):
+        return None
+    parts = filename[:-len('.whl')].split('-')
+    if len(parts) not in (5, 6):
+        return None
+    return {
+        'distribution': parts[0],
+        'version': parts[1],
+        'build': parts[2] if len(parts) == 6 else None,
+        'python': parts[-3],
+        'abi': parts[-2],
+        'platform': parts[-1],
+    }
+
+
+def distribution_name(filename):
+    """Normalized distribution name of a wheel or sdist filename (None for others)."""
+    wheel = parse_wheel_filename(filename)
+    if wheel:
+        return normalize_name(wheel['distribution'])
+    if filename.endswith('.tar.gz') and '-' in filename:
+        return normalize_name(filename[:-len('.tar.gz')].rsplit('-', 1)[0])
+    return None
 
 
 def find_package_files(assets, package_name):
     """
-    Find wheel and tar.gz files in release assets.
-    
+    Find every distribution (wheels, for all their tags, and sdists) of the
+    package in release assets.
+
+    The distributions are matched on the name parsed from their filename. If
+    none matches but the release has distributions of a single other name
+    (a package renamed on the index), those are taken.
+
     Returns:
-        tuple: (wheel_url, tar_gz_url) - either can be None
+        list: the matching assets, wheels first
     """
-    wheel_url = None
-    tar_gz_url = None
-    
-    for asset in assets:
-        name = asset['name']
-        url = asset['browser_download_url']
-        
-        # Look for wheel files
-        if name.endswith('.whl') and package_name.replace('-', '_') in name:
-            wheel_url = url
-        
-        # Look for tar.gz files
-        elif name.endswith('.tar.gz'):
-            tar_gz_url = url
-    
-    return wheel_url, tar_gz_url
+    distributions = [asset for asset in assets if distribution_name(asset['name'])]
+    matches = [
+        asset for asset in distributions
+        if distribution_name(asset['name']) == normalize_name(package_name)
+    ]
+    if not matches and len({distribution_name(asset['name']) for asset in distributions}) == 1:
+        matches = distributions
+    return sorted(matches, key=lambda asset: (not asset['name'].endswith('.whl'), asset['name']))
 
 
-def build_from_source(repo_url, version, package_name, output_dir):
+def download_asset(asset, output_dir):
     """
-    Clone repository and build wheel from source.
-    
+    Download a release asset into output_dir, unless it is already there: a
+    local file matching the size and digest reported for the asset is kept
+    as is, a file that does not is downloaded again.
+
     Returns:
-        tuple: (wheel_path, tar_gz_path)
+        tuple: (path, sha256 hex digest)
     """
-    with tempfile.TemporaryDirectory() as temp_dir:
-        # Clone the repository at specific version
-        repo_dir = os.path.join(temp_dir, 'repo')
-        
-        print(f"Cloning {repo_url} at {version}")
+    path = os.path.join(output_dir, asset['name'])
+    if os.path.exists(path):
+        size, sha256 = asset.get('size'), asset_sha256(asset)
+        if size is None or os.path.getsize(path) == size:
+            digest = sha256_file(path)
+            if not sha256 or digest == sha256:
+                return path, digest
+        print(f"{path} does not match the release asset, downloading it again")
+    digest = with_retries(
+        download_file, asset['browser_download_url'], path,
+        asset.get('size'), asset_sha256(asset)
+    )
+    return path, digest
+
+
+def publish_file(path, output_dir):
+    """Copy a file into output_dir atomically, returns its new path."""
+    dest_path = os.path.join(output_dir, os.path.basename(path))
+    shutil.copy2(path, f'{dest_path}.part')
+    os.replace(f'{dest_path}.part', dest_path)
+    return dest_path
+
+
+def git(*args, cwd=None):
+    """Run a git command, returns its output."""
+    return subprocess.run(
+        ['git', *args], cwd=cwd, check=True, capture_output=True, text=True
+    ).stdout.strip()
+
+
+def build_requires(source_dir):
+    """
+    Requirements of the build backend of a project : `[build-system].requires`
+    of its pyproject.toml, or the setuptools default (PEP 518).
+    """
+    pyproject_path = os.path.join(source_dir, 'pyproject.toml')
+    if not os.path.exists(pyproject_path):
+        return DEFAULT_BUILD_REQUIRES
+    with open(pyproject_path, 'rb') as f:
+        content = f.read()
+
+    try:
+        import tomllib
+    except ImportError:  # Python < 3.11, read the requires array by hand
+        table = re.search(rb'^\[build-system\](.*?)(?=^\[|\Z)', content, re.M | re.S)
+        array = table and re.search(rb'^requires\s*=\s*\[(.*?)\]', table.group(1), re.M | re.S)
+        if not array:
+            return DEFAULT_BUILD_REQUIRES
+        return [
+            (double or single).decode()
+            for double, single in re.findall(rb'"([^"]*)"|\'([^\']*)\'', array.group(1))
+        ]
+    return tomllib.loads(content.decode()).get('build-system', {}).get(
+        'requires', DEFAULT_BUILD_REQUIRES
+    )
+
+
+def interpreter(python):
+    """
+    Version (like cpython3.12), full version and resolved executable of an
+    interpreter.
+    """
+    if python not in INTERPRETERS:
+        INTERPRETERS[python] = json.loads(subprocess.run([
+            python, '-c',
+            'import json, os, sys; print(json.dumps(['
+            'f"{sys.implementation.name}{sys.version_info[0]}.{sys.version_info[1]}", '
+            'sys.version, os.path.realpath(sys.executable)]))'
+        ], check=True, capture_output=True, text=True).stdout)
+    return INTERPRETERS[python]
+
+
+def python_version(python):
+    """Implementation and version of an interpreter, like cpython3.12."""
+    return interpreter(python)[0]
+
+
+def build_key(commit, requires, pythons):
+    """
+    Key of a build in the build cache : what it is built from (the commit),
+    with which backend (its requirements) and for which Pythons.
+    """
+    inputs = json.dumps([commit, sorted(requires), [python_version(python) for python in pythons]])
+    return hashlib.sha256(inputs.encode()).hexdigest()
+
+
+def venv_python(env_dir):
+    if os.name == 'nt':
+        return os.path.join(env_dir, 'Scripts', 'python.exe')
+    return os.path.join(env_dir, 'bin', 'python')
+
+
+def install_requires(python, requires):
+    """
+    Install requirements from the wheelhouse only. Unless offline, the
+    wheels missing from the wheelhouse are downloaded (or built) into it
+    first. pip does not write them atomically, so the wheelhouse is used by
+    one install at a time.
+    """
+    install = [
+        python, '-m', 'pip', 'install', '--quiet', '--no-index',
+        '--find-links', WHEELHOUSE_DIR, *requires
+    ]
+    with WHEELHOUSE_LOCK:
+        if subprocess.run(install, capture_output=True).returncode == 0:
+            return
+        if OFFLINE:
+            raise RuntimeError(f"The wheelhouse lacks some of {requires} to build offline")
         subprocess.run([
-            'git', 'clone', '--depth', '1', '--branch', version,
-            repo_url, repo_dir
+            python, '-m', 'pip', 'wheel', '--quiet', '--wheel-dir', WHEELHOUSE_DIR,
+            '--find-links', WHEELHOUSE_DIR, *requires
         ], check=True)
-        
-        # Install build dependencies
+        subprocess.run(install, check=True)
+
+
+def runs(python):
+    """Whether an interpreter runs (its executable, or the one it links to, exists)."""
+    try:
+        return subprocess.run([python, '-c', ''], capture_output=True).returncode == 0
+    except OSError:
+        return False
+
+
+def build_env(requires, python=sys.executable):
+    """
+    Build environment with `build` and the requirements of a build backend
+    installed, shared by every build with the same requirements and
+    interpreter. It is created from the wheelhouse, so it does not need the
+    network once the wheelhouse holds the backend.
+
+    The environment links to its interpreter, so it is keyed by the path and
+    full version of that interpreter, and created again if it does not run
+    anymore (interpreter moved or removed).
+
+    Args:
+        requires: Requirements of the build backend
+        python: Interpreter of the environment
+
+    Returns:
+        str: path of the python of the environment
+    """
+    inputs = json.dumps([sorted(requires), *interpreter(python)])
+    env_dir = os.path.join(ENV_DIR, hashlib.sha256(inputs.encode()).hexdigest())
+
+    with ENV_LOCKS.setdefault(env_dir, threading.Lock()):
+        if os.path.exists(env_dir):
+            if runs(venv_python(env_dir)):
+                return venv_python(env_dir)
+            print(f"Removing the broken build environment {env_dir}")
+            shutil.rmtree(env_dir, ignore_errors=True)
+
+        print(f"Creating a build environment for {', '.join(requires)}")
+        os.makedirs(ENV_DIR, exist_ok=True)
+        os.makedirs(WHEELHOUSE_DIR, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(dir=ENV_DIR, suffix='.tmp')
+        try:
+            subprocess.run([python, '-m', 'venv', tmp_dir], check=True)
+            # Run through `python -m`, so the environment can be moved. The
+            # setuptools seeded by venv (Python < 3.12) is removed first, or
+            # its old version would satisfy the requirements instead of the
+            # one of the wheelhouse
+            subprocess.run([
+                venv_python(tmp_dir), '-m', 'pip', 'uninstall', '--quiet', '--yes', 'setuptools'
+            ], check=True, capture_output=True)
+            install_requires(venv_python(tmp_dir), ['build', *requires])
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        try:
+            os.replace(tmp_dir, env_dir)
+        except OSError:
+            # Created by another process in the meantime
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    return venv_python(env_dir)
+
+
+def install_dynamic_requires(env_python, source_dir, distributions):
+    """
+    Install into a build environment the requirements the build backend asks
+    for beyond `[build-system].requires` (`get_requires_for_build_wheel()`
+    and co, like `wheel` for older setuptools), from the wheelhouse.
+    """
+    output = subprocess.run(
+        [env_python, '-c', UNMET_REQUIRES_SCRIPT, *distributions],
+        cwd=source_dir, check=True, capture_output=True, text=True
+    ).stdout
+    # The hooks may print too, the requirements come last
+    missing = json.loads(output.splitlines()[-1])
+    if missing:
+        print(f"Installing the build requirements {', '.join(missing)}")
+        env_dir = os.path.dirname(os.path.dirname(env_python))
+        with ENV_LOCKS.setdefault(env_dir, threading.Lock()):
+            install_requires(env_python, missing)
+
+
+def store_build(key, paths):
+    """Store the files of a build in the build cache."""
+    os.makedirs(BUILD_CACHE_DIR, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=BUILD_CACHE_DIR, suffix='.tmp')
+    for path in paths:
+        shutil.copy2(path, tmp_dir)
+    try:
+        os.rename(tmp_dir, os.path.join(BUILD_CACHE_DIR, key))
+    except OSError:
+        # Stored by someone else in the meantime
+        shutil.rmtree(tmp_dir)
+
+
+def cached_build(key):
+    """Paths of the files of a cached build, or None."""
+    build_dir = os.path.join(BUILD_CACHE_DIR, key)
+    if not os.path.isdir(build_dir):
+        return None
+    return [os.path.join(build_dir, name) for name in sorted(os.listdir(build_dir))]
+
+
+def fetch_archive(repo_url, tag, source_dir):
+    """
+    Fetch the sources of a tag as the archive GitHub generates for it, unpacked
+    into source_dir while it streams (no history, no checkout).
+
+    Returns:
+        tuple: (commit, commit time) - the commit is None if unknown
+    """
+    parts = repo_url.rstrip('/').split('/')
+    owner, repo = parts[-2], parts[-1]
+    url = f"{API_URL}/repos/{owner}/{repo}/tarball/{urllib.parse.quote(tag)}"
+
+    epoch = None
+    with github_request(url, {}) as response:
+        with tarfile.open(fileobj=response, mode='r|gz') as archive:
+            for member in archive:
+                # Strip the top-level <owner>-<repo>-<commit>/ directory
+                name = member.name.partition('/')[2]
+                if not name:
+                    continue
+                if name.startswith('/') or '..' in name.split('/'):
+                    raise ValueError(f"Unsafe path in the archive of {repo_url}: {member.name}")
+                member.name = name
+                if member.issym() or member.islnk():
+                    # Keep links inside the sources
+                    if os.path.isabs(member.linkname) or '..' in member.linkname.split('/'):
+                        continue
+                    if member.islnk():
+                        member.linkname = member.linkname.partition('/')[2]
+                archive.extract(member, source_dir, **EXTRACT_OPTIONS)
+                epoch = epoch or member.mtime
+            # git archive stores the commit in the global header
+            commit = archive.pax_headers.get('comment')
+    return commit, epoch
+
+
+def mirror_path(repo_url):
+    parts = repo_url.rstrip('/').split('/')
+    return os.path.join(MIRROR_DIR, f'{parts[-2]}--{parts[-1]}.git')
+
+
+def configure_mirror(path):
+    """
+    Fetch only the branches and tags into a mirror : a `--mirror` refspec
+    would also bring every pull request of a GitHub repository. The pull
+    request refs of mirrors cloned that way before are dropped.
+    """
+    git('config', '--replace-all', 'remote.origin.fetch', MIRROR_REFSPECS[0], cwd=path)
+    for refspec in MIRROR_REFSPECS[1:]:
+        git('config', '--add', 'remote.origin.fetch', refspec, cwd=path)
+    subprocess.run(['git', 'config', '--unset', 'remote.origin.mirror'], cwd=path, capture_output=True)
+    other_refs = git('for-each-ref', '--format=delete %(refname)', 'refs/pull', cwd=path)
+    if other_refs:
+        subprocess.run(
+            ['git', 'update-ref', '--stdin'], cwd=path, input=other_refs + '\n', text=True, check=True
+        )
+
+
+def update_mirror(repo_url):
+    """
+    Bring the bare mirror of a repository up to date : a blobless bare clone
+    the first time, then an incremental fetch of its branches and tags (once
+    per run). Must be called with the lock of the mirror held.
+
+    Returns:
+        str: path of the mirror
+    """
+    path = mirror_path(repo_url)
+    if not os.path.exists(path):
+        print(f"Mirroring {repo_url}")
+        os.makedirs(MIRROR_DIR, exist_ok=True)
+        tmp_path = tempfile.mkdtemp(dir=MIRROR_DIR, suffix='.tmp')
         subprocess.run([
-            'pip', 'install', '--quiet', 'build'
+            'git', 'clone', '--quiet', '--bare', '--filter=blob:none', repo_url, tmp_path
         ], check=True)
+        configure_mirror(tmp_path)
+        os.replace(tmp_path, path)
+    elif path not in FETCHED_MIRRORS:
+        configure_mirror(path)
+        git('fetch', '--quiet', '--prune', 'origin', cwd=path)
+        # Forget the worktrees of previous builds, whose directories are gone
+        git('worktree', 'prune', cwd=path)
+    FETCHED_MIRRORS.add(path)
+    # Mark it as recently used
+    os.utime(path)
+    return path
+
+
+def prune_mirrors(max_bytes=MIRROR_MAX_BYTES):
+    """
+    Remove the least recently used mirrors beyond max_bytes, except those
+    used during this run and the clones in progress.
+    """
+    if not os.path.isdir(MIRROR_DIR):
+        return
+    with MIRROR_PRUNE_LOCK:
+        mirrors = []
+        for name in os.listdir(MIRROR_DIR):
+            path = os.path.join(MIRROR_DIR, name)
+            size = sum(
+                os.path.getsize(os.path.join(directory, filename))
+                for directory, _, filenames in os.walk(path) for filename in filenames
+            )
+            mirrors.append((os.path.getmtime(path), size, path))
+
+        total = sum(size for _, size, _ in mirrors)
+        for _, size, path in sorted(mirrors):
+            if total <= max_bytes:
+                break
+            if path in USED_MIRRORS or path.endswith('.tmp'):
+                continue
+            print(f"Removing mirror {path}")
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+
+def fetch_clone(repo_url, tag, source_dir):
+    """
+    Fetch the sources of a tag as a worktree of the (blobless) bare mirror of
+    the repository : all the commits and tags are there (for the tools
+    computing the version from git, like setuptools_scm), and building many
+    versions of a repository costs one clone and one checkout per version.
+
+    Returns:
+        tuple: (commit, commit time)
+    """
+    path = mirror_path(repo_url)
+    USED_MIRRORS.add(path)
+    with MIRROR_LOCKS.setdefault(path, threading.Lock()):
+        update_mirror(repo_url)
+        git('worktree', 'add', '--quiet', '--detach', source_dir, f'refs/tags/{tag}', cwd=path)
+    prune_mirrors()
+    return git('rev-parse', 'HEAD', cwd=source_dir), int(git('log', '-1', '--format=%ct', cwd=source_dir))
+
+
+# Safe extraction, on the Python versions supporting it (PEP 706)
+EXTRACT_OPTIONS = {'filter': 'data'} if hasattr(tarfile, 'data_filter') else {}
+
+
+# Ways of fetching the sources to build, selected per package
+SOURCE_FETCHERS = {
+    'archive': fetch_archive,
+    'clone': fetch_clone,
+}
+DEFAULT_SOURCE_FETCH = 'archive'
+
+
+def needs_vcs(requires):
+    """Whether a build backend needs the git metadata, to compute the version."""
+    names = {normalize_name(re.match(r'[A-Za-z0-9._-]*', req).group()) for req in requires}
+    return bool(names & VCS_VERSIONING_BACKENDS)
+
+
+def build_dists(python, requires, source_dir, dist_dir, epoch, wheel_only=False):
+    """
+    Build the distributions of a project with an interpreter, in the build
+    environment of its requirements (runs in a worker thread).
+
+    Returns:
+        tuple: (paths of the built files, seconds spent)
+    """
+    start = time.perf_counter()
+    env_python = build_env(requires, python)
+    install_dynamic_requires(env_python, source_dir, ['wheel'] if wheel_only else ['sdist', 'wheel'])
+    env = dict(os.environ)
+    if epoch:
+        env['SOURCE_DATE_EPOCH'] = str(epoch)
+    subprocess.run([
+        env_python, '-m', 'build', '--no-isolation', '--outdir', dist_dir,
+        *(['--wheel'] if wheel_only else [])
+    ], cwd=source_dir, env=env, check=True)
+    files = [os.path.join(dist_dir, name) for name in sorted(os.listdir(dist_dir))]
+    return files, time.perf_counter() - start
+
+
+def is_pure(wheel_path):
+    """Whether a wheel works on any interpreter and platform."""
+    wheel = parse_wheel_filename(os.path.basename(wheel_path))
+    return wheel['abi'] == 'none' and wheel['platform'] == 'any'
+
+
+def build_from_source(repo_url, version, package_name, output_dir, source_fetch=None,
+                      pythons=None):
+    """
+    Fetch the sources of a version and build its sdist and wheels.
+
+    The sources are fetched as the archive of the tag, or else as a blobless
+    clone : when the package asks for it (`source_fetch='clone'`), or when
+    its build backend computes the version from git (setuptools_scm...).
+
+    The sdist and a first wheel are built with the first interpreter. If the
+    wheel is specific to an interpreter or platform, the wheels of the other
+    interpreters are then built concurrently (in threads, each waiting on
+    its build subprocess).
+
+    Builds are cached by commit, build requirements and Pythons, and are
+    reproducible : SOURCE_DATE_EPOCH is set to the time of the commit.
+    They run without isolation, in a build environment shared by the builds
+    with the same requirements (see `build_env()`).
+
+    Args:
+        pythons: Interpreters to build wheels for (BUILD_PYTHONS by default)
+    
+    Returns:
+        list: Paths of the files built, wheels first
+    """
+    source_fetch = source_fetch or DEFAULT_SOURCE_FETCH
+    pythons = pythons or BUILD_PYTHONS
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # Fetch the sources at specific version
+        repo_dir = os.path.join(temp_dir, 'repo')
+        dist_dir = os.path.join(temp_dir, 'dist')
         
-        # Build the package
-        print(f"Building package from source")
-        subprocess.run([
-            'python', '-m', 'build', '--outdir', temp_dir
-        ], cwd=repo_dir, check=True)
-        
-        # Find generated files
-        wheel_path = None
-        tar_gz_path = None
+        print(f"Fetching {repo_url} at {version} ({source_fetch})")
+        with timed('build', phase='fetch', package=package_name, version=version, mode=source_fetch):
+            commit, epoch = SOURCE_FETCHERS[source_fetch](repo_url, version, repo_dir)
+        requires = build_requires(repo_dir)
+        if source_fetch != 'clone' and needs_vcs(requires):
+            print(f"The build backend needs git metadata, cloning {repo_url} instead")
+            shutil.rmtree(repo_dir)
+            with timed('build', phase='fetch', package=package_name, version=version, mode='clone'):
+                commit, epoch = fetch_clone(repo_url, version, repo_dir)
+        key = build_key(commit, requires, pythons) if commit else None
         
-        for file in os.listdir(temp_dir):
-            if file.endswith('.whl'):
-                wheel_path = os.path.join(temp_dir, file)
-                shutil.copy2(wheel_path, output_dir)
-                wheel_path = os.path.join(output_dir, file)
-            elif file.endswith('.tar.gz'):
-                tar_gz_path = os.path.join(temp_dir, file)
-                shutil.copy2(tar_gz_path, output_dir)
-                tar_gz_path = os.path.join(output_dir, file)
+        files = cached_build(key) if key else None
+        if files:
+            print(f"Using cached build of {commit}")
+            record('build', phase='cached', package=package_name, version=version, seconds=0)
+        else:
+            # Build the sdist and a wheel with the first interpreter
+            print(f"Building package from source with {pythons[0]}")
+            files, seconds = build_dists(pythons[0], requires, repo_dir, dist_dir, epoch)
+            record('build', phase='build', package=package_name, version=version,
+                   python=pythons[0], seconds=round(seconds, 3))
+            
+            # Then the wheels of the other interpreters, if they differ
+            wheels = [path for path in files if path.endswith('.whl')]
+            if len(pythons) > 1 and wheels and not is_pure(wheels[0]):
+                print(f"Building wheels with {', '.join(pythons[1:])}")
+                jobs = []
+                for i, python in enumerate(pythons[1:], 1):
+                    # Each build gets its own copy of the sources
+                    source_dir = f'{repo_dir}-{i}'
+                    shutil.copytree(repo_dir, source_dir, symlinks=True)
+                    jobs.append((python, requires, source_dir, f'{dist_dir}-{i}', epoch, True))
+                with ThreadPoolExecutor(max_workers=min(len(jobs), os.cpu_count() or 1)) as executor:
+                    results = list(executor.map(build_dists, *zip(*jobs)))
+                for python, (python_files, seconds) in zip(pythons[1:], results):
+                    record('build', phase='build', package=package_name, version=version,
+                           python=python, seconds=round(seconds, 3))
+                    files.extend(path for path in python_files if path.endswith('.whl'))
+            if key:
+                store_build(key, files)
         
-        return wheel_path, tar_gz_path
+        # Publish the generated files (once per filename), wheels first
+        files = {os.path.basename(path): path for path in reversed(files)}
+        names = sorted(files, key=lambda name: (not name.endswith('.whl'), name))
+        return [publish_file(files[name], output_dir) for name in names]
 
 
-def download_package_files(repo_url, version, package_name, output_dir):
+def download_package_files(repo_url, version, package_name, output_dir, source_fetch=None):
     """
     Download or build package files for a specific version.
     
@@ -146,66 +1316,62 @@ def download_package_files(repo_url, version, package_name, output_dir):
         version: Version to download
         package_name: Name of the package
         output_dir: Directory to save files
+        source_fetch: How to fetch the sources, if they need to be built (a
+            key of SOURCE_FETCHERS, 'archive' by default)
     
     Returns:
-        dict: Paths to downloaded/built files
+        dict: Paths to downloaded/built files (the first wheel under 'wheel',
+        the sdist under 'tar_gz', and every file under 'files'), their sha256
+        digests (keyed by path) under 'sha256', and the tag of the release
+        they come from under 'tag' (when there is a release)
+
+    Raises:
+        Exception: when the release cannot be fetched (after retrying
+        transient errors), or the source build fails
     """
     os.makedirs(output_dir, exist_ok=True)
     
+    result = {
+        'wheel': None,
+        'tar_gz': None,
+        'version': version,
+        'sha256': {}
+    }
+    
+    # Try to get files from GitHub releases. Transient errors are retried,
+    # any other error is raised : only a missing release (or one without
+    # files) is worth building from source
     try:
-        # Try to get files from GitHub releases
-        assets = get_release_assets(repo_url, version)
-        wheel_url, tar_gz_url = find_package_files(assets, package_name)
-        
-        result = {
-            'wheel': None,
-            'tar_gz': None,
-            'version': version
-        }
-        
-        # Download wheel if available
-        if wheel_url:
-            wheel_name = wheel_url.split('/')[-1]
-            wheel_path = os.path.join(output_dir, wheel_name)
-            if not os.path.exists(wheel_path):
-                download_file(wheel_url, wheel_path)
-            result['wheel'] = wheel_path
-        
-        # Download tar.gz if available
-        if tar_gz_url:
-            tar_name = tar_gz_url.split('/')[-1]
-            tar_path = os.path.join(output_dir, tar_name)
-            if not os.path.exists(tar_path):
-                download_file(tar_gz_url, tar_path)
-            result['tar_gz'] = tar_path
-        
-        # If no files found in release, try building from source
-        if not wheel_url and not tar_gz_url:
-            print(f"No package files in release, building from source")
-            wheel_path, tar_gz_path = build_from_source(
-                repo_url, version, package_name, output_dir
-            )
-            result['wheel'] = wheel_path
-            result['tar_gz'] = tar_gz_path
-        
-        return result
-        
+        tag, assets = resolve_release(repo_url, version)
+        package_assets = find_package_files(assets, package_name)
+        result['tag'] = tag
     except Exception as e:
-        print(f"Error downloading package files: {e}")
-        # Fallback to building from source
-        try:
-            print(f"Falling back to building from source")
-            wheel_path, tar_gz_path = build_from_source(
-                repo_url, version, package_name, output_dir
-            )
-            return {
-                'wheel': wheel_path,
-                'tar_gz': tar_gz_path,
-                'version': version
-            }
-        except Exception as build_error:
-            print(f"Failed to build from source: {build_error}")
+        if classify_error(e) != NOT_FOUND:
             raise
+        print(f"{e}")
+        package_assets = []
+    
+    if package_assets:
+        # Download all the files at once
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_THREADS) as executor:
+            downloads = list(executor.map(
+                lambda asset: download_asset(asset, output_dir), package_assets
+            ))
+        result['sha256'] = dict(downloads)
+        result['files'] = [path for path, _ in downloads]
+    
+    # If no files found in release, try building from source
+    else:
+        print(f"No package files in release, building from source")
+        result['files'] = build_from_source(
+            repo_url, result.get('tag', version), package_name, output_dir, source_fetch
+        )
+        result['sha256'] = {path: sha256_file(path) for path in result['files']}
+    
+    result['wheel'] = next((p for p in result['files'] if p.endswith('.whl')), None)
+    result['tar_gz'] = next((p for p in result['files'] if p.endswith('.tar.gz')), None)
+    
+    return result
 
 
 def main():
@@ -0,0 +1,88 @@
+"""
+Manifest of the index : the single source of truth for the packages, their
+versions and their files. The HTML pages and the simple API are derived from
+it.
+
+Layout of `manifest.json` :
+
+    {
+      "packages": {
+        "<normalized name>": {
+          "name": "<display name>",
+          "author": "...",
+          "short_desc": "...",
+          "homepage": "https://github.com/<owner>/<repo>",
+          "source_fetch": "archive" | "clone",
+          "versions": [
+            {
+              "version": "<tag, as registered>",
+              "norm_version": "<version shown on the pages>",
+              "tag": "<tag of the GitHub release the files come from>",
+              "files": [
+                {
+                  "filename": "...",
+                  "sha256": "...",
+                  "size": 1234,
+                  "upload_time": "2024-01-01T00:00:00.000000Z",
+                  "requires_python": ">=3.9",
+                  "core_metadata_sha256": "..."
+                }
+              ]
+            }
+          ]
+        }
+      }
+    }
+
+Versions are kept in publication order. `tag`, `requires_python` and
+`core_metadata_sha256` are only present when known.
+
+`source_fetch` tells how to fetch the sources of the package when they need
+to be built (see `download_release.SOURCE_FETCHERS`). It is only present
+when set at registration.
+"""
+
+import json
+import os
+
+
+MANIFEST_FILE = "manifest.json"
+
+
+def load_manifest(path=MANIFEST_FILE):
+    if not os.path.exists(path):
+        return {"packages": {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, path=MANIFEST_FILE):
+    # Write to a temporary file first, so an interrupted run never leaves a
+    # truncated manifest behind
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        f.write("\n")
+    os.replace(tmp_path, path)
+
+
+def is_stable(version):
+    return not ("dev" in version or "a" in version or "b" in version or "rc" in version)
+
+
+def latest_version(package):
+    """
+    The version shown as the latest one : the last stable version published,
+    or the first (registered) one if there is no stable version.
+    """
+    stable = [v for v in package["versions"] if is_stable(v["version"])]
+    return stable[-1] if stable else package["versions"][0]
+
+
+def files_by_name(package):
+    """ All the distinct files of a package, by filename """
+    files = {}
+    for version in package["versions"]:
+        for file in version["files"]:
+            files.setdefault(file["filename"], file)
+    return files
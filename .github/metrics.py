@@ -0,0 +1,87 @@
+"""
+Timing events of the actions : GitHub API calls, downloads (time to first
+byte, transfer time, bytes), source builds and rendering.
+
+Each action appends its events to a JSON-lines report (`metrics.jsonl`, or
+`$PKG_METRICS_FILE`), one object per event, and prints a summary of them.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+METRICS_FILE = os.environ.get("PKG_METRICS_FILE", "metrics.jsonl")
+
+EVENTS = []
+EVENTS_LOCK = threading.Lock()
+
+
+def record(event, **fields):
+    """ Record an event, with its fields (durations in seconds) """
+    with EVENTS_LOCK:
+        EVENTS.append({"event": event, "time": round(time.time(), 3), **fields})
+
+
+@contextmanager
+def timed(event, **fields):
+    """ Record an event with the time spent in the `with` block, as `seconds` """
+    start = time.perf_counter()
+    try:
+        yield fields
+    finally:
+        record(event, seconds=round(time.perf_counter() - start, 3), **fields)
+
+
+def summary(events):
+    """ Lines summarizing the events of a run """
+    lines = []
+
+    api_calls = [e for e in events if e["event"] == "api"]
+    if api_calls:
+        statuses = {}
+        for e in api_calls:
+            statuses[e["status"]] = statuses.get(e["status"], 0) + 1
+        by_status = ", ".join(
+            f"{count} x {status}" for status, count in sorted(statuses.items(), key=str)
+        )
+        seconds = sum(e["seconds"] for e in api_calls)
+        lines.append(f"API calls: {len(api_calls)} in {seconds:.1f}s ({by_status})")
+
+    downloads = [e for e in events if e["event"] == "download"]
+    cached = [e for e in downloads if e.get("cached")]
+    transfers = [e for e in downloads if not e.get("cached")]
+    if downloads:
+        size = sum(e["bytes"] for e in transfers)
+        seconds = sum(e["transfer_seconds"] for e in transfers)
+        line = f"Downloads: {len(transfers)} files, {size / 1024 ** 2:.1f} MiB in {seconds:.1f}s"
+        if transfers:
+            ttfb = sum(e["ttfb"] for e in transfers) / len(transfers)
+            throughput = size / 1024 ** 2 / seconds if seconds else 0
+            line += f" ({throughput:.1f} MiB/s, first byte after {ttfb:.2f}s on average)"
+        lines.append(f"{line}, {len(cached)} from the cache")
+
+    phases = {}
+    for e in events:
+        if e["event"] in ("build", "render"):
+            name = e["event"] if e["event"] == "render" else f"build {e['phase']}"
+            phases[name] = phases.get(name, 0) + e["seconds"]
+    lines.extend(f"{name}: {seconds:.1f}s" for name, seconds in phases.items())
+    return lines
+
+
+def report(path=METRICS_FILE):
+    """ Append the events recorded so far to the report, and print their summary """
+    with EVENTS_LOCK:
+        events = EVENTS[:]
+        EVENTS.clear()
+    if not events:
+        return
+
+    with open(path, "a") as f:
+        for event in events:
+            f.write(json.dumps(event, sort_keys=True) + "\n")
+
+    print("\n".join(["Metrics:"] + [f"  {line}" for line in summary(events)]))
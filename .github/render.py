@@ -0,0 +1,398 @@
+"""
+Render the whole site from the manifest : the main index, the package pages
+and the simple API (lean PEP 503 pages and PEP 691 JSON).
+
+Rendering is deterministic : the same manifest and templates always give
+byte-identical pages. It is also incremental : the hash of the inputs of
+each group of pages is cached in `.render_cache.json`, and groups whose
+inputs did not change are not rendered again.
+"""
+
+import hashlib
+import html
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import manifest as manifest_module
+from manifest import files_by_name, is_stable, latest_version
+from metrics import timed
+
+
+INDEX_FILE = "index.html"
+INDEX_TEMPLATE_FILE = "index_template.html"
+TEMPLATE_FILE = "pkg_template.html"
+PACKAGES_DIR = "packages"
+STATIC_DIR = "static"
+RENDER_CACHE_FILE = ".render_cache.json"
+SIMPLE_DIR = "simple"
+SIMPLE_JSON_FILE = "index.json"
+SIMPLE_API_VERSION = "1.1"
+
+# Below this number of pages, spawning worker processes costs more than it saves
+PARALLEL_THRESHOLD = 32
+
+INDEX_CARD_HTML = '''    <a class="card" href="_norm_name/">
+      _name
+      <span>
+      </span>
+      <span class="version">
+        _version
+      </span>
+      <br />
+      <span class="description">
+        _short_desc
+      </span>
+    </a>'''
+
+VERSION_HTML = '''          <div id="_version" class="_class" onclick="load_readme('_version', scroll_to_div=true)">
+_links
+          </div>'''
+
+# Lean PEP 503 pages, for installers only : no script, no style
+SIMPLE_PAGE_HTML = '''<!DOCTYPE html>
+<html>
+  <head>
+    <meta name="pypi:repository-version" content="{api_version}">
+    <title>{title}</title>
+  </head>
+  <body>
+    <h1>{title}</h1>
+{links}
+  </body>
+</html>
+'''
+SIMPLE_LINK_HTML = '    <a href="{href}"{attributes}>{text}</a><br/>'
+
+
+def fill_template(template, values):
+    """
+    Replace the `_placeholder` names of a template, in a single pass : a value
+    containing a placeholder name is never replaced again.
+    """
+    names = sorted(values, key=len, reverse=True)
+    pattern = re.compile(r"(?<!\w)_(" + "|".join(names) + r")(?!\w)")
+    return pattern.sub(lambda match: values[match.group(1)], template)
+
+
+def transform_github_url(input_url):
+    # Split the input URL to extract relevant information
+    parts = input_url.rstrip('/').split('/')
+    username, repo = parts[-2], parts[-1]
+
+    # Create the raw GitHub content URL
+    raw_url = f'https://raw.githubusercontent.com/{username}/{repo}/main/README.md'
+    return raw_url
+
+
+def dist_version(filename):
+    """ Version of a distribution, from its (wheel or sdist) filename """
+    if filename.endswith(".whl"):
+        return filename.split("-")[1]
+    return filename[:-len(".tar.gz")].rsplit("-", 1)[-1]
+
+
+def link_attributes(file):
+    """
+    Compute the extra anchor attributes to publish for a file of the manifest.
+
+    Returns:
+        dict of attribute name to (unescaped) value
+    """
+    attributes = {}
+    if file.get("core_metadata_sha256"):
+        attributes["data-dist-info-metadata"] = f"sha256={file['core_metadata_sha256']}"
+        attributes["data-core-metadata"] = f"sha256={file['core_metadata_sha256']}"
+    if file.get("requires_python"):
+        attributes["data-requires-python"] = file["requires_python"]
+    return attributes
+
+
+def format_attributes(attributes):
+    return "".join(
+        f' {name}="{html.escape(value)}"' for name, value in attributes.items()
+    )
+
+
+def get_package_links(norm_pkg_name, version, homepage):
+    """
+    Generate HTML links for the files of a version.
+
+    Args:
+        norm_pkg_name: Normalized name of the package
+        version: Manifest record of the version
+        homepage: Homepage of the package, for the git URL fallback
+
+    Returns:
+        String containing one HTML anchor element per wheel and tar.gz file
+        of the version
+    """
+    links = []
+    base_url = f"../{PACKAGES_DIR}/{norm_pkg_name}/"
+    norm_version = html.escape(version["norm_version"])
+
+    for file in version["files"]:
+        href = html.escape(f"{base_url}{file['filename']}#sha256={file['sha256']}")
+        attributes = format_attributes(link_attributes(file))
+        title = html.escape(file["filename"])
+        links.append(f'<a href="{href}" title="{title}"{attributes}>{norm_version}</a>')
+
+    if not links:
+        # Fallback to git URL (without egg parameter)
+        href = html.escape(f"git+{homepage}@{version['version']}")
+        return f'<a href="{href}">{norm_version}</a>'
+
+    return "\n".join(links)
+
+
+def render_index(manifest, template):
+    cards = []
+    for norm_pkg_name, package in sorted(manifest["packages"].items()):
+        cards.append(fill_template(INDEX_CARD_HTML, {
+            "norm_name": html.escape(norm_pkg_name),
+            "name": html.escape(package["name"]),
+            "version": html.escape(latest_version(package)["norm_version"]),
+            "short_desc": html.escape(package["short_desc"]),
+        }))
+    return fill_template(template, {"package_cards": "\n".join(cards)})
+
+
+def render_package_page(norm_pkg_name, package, template):
+    versions = []
+    for version in package["versions"]:
+        links = get_package_links(norm_pkg_name, version, package["homepage"])
+        versions.append(fill_template(VERSION_HTML, {
+            "version": html.escape(version["version"]),
+            "class": "" if is_stable(version["version"]) else "prerelease",
+            "links": "\n".join(f"            {link}" for link in links.splitlines()),
+        }))
+
+    latest = html.escape(latest_version(package)["version"])
+    return fill_template(template, {
+        "package_name": html.escape(package["name"]),
+        "version": latest,
+        "latest_main": latest,
+        "versions": "\n".join(versions),
+        "homepage": html.escape(package["homepage"]),
+        "author": html.escape(package["author"]),
+        "long_description": html.escape(transform_github_url(package["homepage"])),
+    })
+
+
+def render_simple_page(title, links):
+    """
+    Render a lean PEP 503 page.
+
+    Args:
+        title: Title of the page
+        links: List of (href, attributes, text) tuples
+    """
+    links = "\n".join(
+        SIMPLE_LINK_HTML.format(
+            href=html.escape(href), attributes=format_attributes(attributes),
+            text=html.escape(text)
+        )
+        for href, attributes, text in links
+    )
+    return SIMPLE_PAGE_HTML.format(
+        api_version=SIMPLE_API_VERSION, title=html.escape(title), links=links
+    )
+
+
+def render_json(data):
+    return json.dumps(data, indent=2, sort_keys=True) + "\n"
+
+
+def render_simple_project(norm_pkg_name, package):
+    """
+    Render the simple pages of a package : the PEP 691 JSON page and the lean
+    PEP 503 page for installers.
+
+    Returns:
+        tuple: (html, json) contents
+    """
+    files = []
+    links = []
+    for filename, file in sorted(files_by_name(package).items()):
+        url = f"../../{PACKAGES_DIR}/{norm_pkg_name}/{filename}"
+        core_metadata = False
+        if file.get("core_metadata_sha256"):
+            core_metadata = {"sha256": file["core_metadata_sha256"]}
+        files.append({
+            "filename": filename,
+            "url": url,
+            "hashes": {"sha256": file["sha256"]},
+            "core-metadata": core_metadata,
+            "dist-info-metadata": core_metadata,
+            "yanked": False,
+            "size": file["size"],
+            "upload-time": file["upload_time"],
+        })
+        if file.get("requires_python"):
+            files[-1]["requires-python"] = file["requires_python"]
+        links.append((f"{url}#sha256={file['sha256']}", link_attributes(file), filename))
+
+    json_page = render_json({
+        "meta": {"api-version": SIMPLE_API_VERSION},
+        "name": norm_pkg_name,
+        "files": files,
+        "versions": sorted({dist_version(file["filename"]) for file in files}),
+    })
+    return render_simple_page(f"Links for {norm_pkg_name}", links), json_page
+
+
+def render_simple_index(manifest):
+    """
+    Render the simple project lists : the PEP 503 one and the PEP 691 JSON one.
+
+    Returns:
+        tuple: (html, json) contents
+    """
+    projects = sorted(manifest["packages"])
+    json_page = render_json({
+        "meta": {"api-version": SIMPLE_API_VERSION},
+        "projects": [{"name": name} for name in projects],
+    })
+    html_page = render_simple_page(
+        "Simple index", [(f"{name}/", {}, name) for name in projects]
+    )
+    return html_page, json_page
+
+
+def package_page_paths(norm_pkg_name):
+    return [
+        os.path.join(norm_pkg_name, INDEX_FILE),
+        os.path.join(SIMPLE_DIR, norm_pkg_name, INDEX_FILE),
+        os.path.join(SIMPLE_DIR, norm_pkg_name, SIMPLE_JSON_FILE),
+    ]
+
+
+def render_package(job):
+    """ Render every page of a package, returns a list of (path, content) """
+    norm_pkg_name, package, template = job
+    simple_html, simple_json = render_simple_project(norm_pkg_name, package)
+    package_page = render_package_page(norm_pkg_name, package, template)
+    return list(zip(package_page_paths(norm_pkg_name), [package_page, simple_html, simple_json]))
+
+
+def write_page(path, content):
+    """ Write a page, returns whether its content changed """
+    if os.path.exists(path):
+        with open(path) as f:
+            if f.read() == content:
+                return False
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+    return True
+
+
+def input_hash(*inputs):
+    """ Hash of the (JSON serializable) inputs of a group of pages """
+    serialized = json.dumps(inputs, sort_keys=True).encode()
+    return hashlib.sha256(serialized).hexdigest()
+
+
+def files_hash(paths):
+    """ Hash of the content of some files (the renderer itself, static assets...) """
+    digest = hashlib.sha256()
+    for path in sorted(paths):
+        digest.update(os.path.basename(path).encode())
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def static_version():
+    """ Version of the static assets, as the hash of their content """
+    if not os.path.isdir(STATIC_DIR):
+        return None
+    return files_hash([os.path.join(STATIC_DIR, name) for name in os.listdir(STATIC_DIR)])
+
+
+def load_render_cache():
+    if not os.path.exists(RENDER_CACHE_FILE):
+        return {}
+    with open(RENDER_CACHE_FILE) as f:
+        return json.load(f)
+
+
+def save_render_cache(cache):
+    with open(RENDER_CACHE_FILE, "w") as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+@timed("render")
+def render_site(manifest, workers=None, force=False):
+    """
+    Render the pages of the site from the manifest. Only the groups of pages
+    whose inputs changed (or whose pages are missing) are rendered, and
+    package pages are rendered in parallel across cores when there are many
+    of them.
+
+    Args:
+        manifest: The manifest of the index
+        workers: Number of worker processes (defaults to the number of cores)
+        force: Render every page, ignoring the cache
+
+    Returns:
+        list: Paths of the pages whose content changed
+    """
+    with open(INDEX_TEMPLATE_FILE) as f:
+        index_template = f.read()
+    with open(TEMPLATE_FILE) as f:
+        template = f.read()
+
+    cache = {} if force else load_render_cache()
+    # The renderer, and the manifest helpers deciding the latest version and
+    # the prereleases
+    renderer = files_hash([os.path.abspath(__file__), os.path.abspath(manifest_module.__file__)])
+    static = static_version()
+    new_cache = {}
+
+    def is_stale(key, paths, *inputs):
+        new_cache[key] = input_hash(renderer, static, *inputs)
+        return cache.get(key) != new_cache[key] or not all(map(os.path.exists, paths))
+
+    pages = []
+    rebuilt = []
+
+    # Main index, it only shows a summary of each package
+    summary = [
+        (name, package["name"], latest_version(package)["norm_version"], package["short_desc"])
+        for name, package in sorted(manifest["packages"].items())
+    ]
+    if is_stale("index", [INDEX_FILE], index_template, summary):
+        pages.append((INDEX_FILE, render_index(manifest, index_template)))
+        rebuilt.append("index")
+
+    simple_paths = [os.path.join(SIMPLE_DIR, INDEX_FILE), os.path.join(SIMPLE_DIR, SIMPLE_JSON_FILE)]
+    if is_stale("simple", simple_paths, sorted(manifest["packages"])):
+        pages.extend(zip(simple_paths, render_simple_index(manifest)))
+        rebuilt.append("simple")
+
+    jobs = [
+        (norm_pkg_name, package, template)
+        for norm_pkg_name, package in sorted(manifest["packages"].items())
+        if is_stale(f"package:{norm_pkg_name}", package_page_paths(norm_pkg_name), template, package)
+    ]
+    if workers != 1 and len(jobs) * 3 >= PARALLEL_THRESHOLD:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            rendered = list(executor.map(render_package, jobs))
+    else:
+        rendered = [render_package(job) for job in jobs]
+    for package_pages in rendered:
+        pages.extend(package_pages)
+    rebuilt.extend(norm_pkg_name for norm_pkg_name, _, _ in jobs)
+
+    changed = [path for path, content in pages if write_page(path, content)]
+    save_render_cache(new_cache)
+
+    total = len(manifest["packages"]) + 2
+    print(f"Rendered {len(rebuilt)}/{total} page groups ({len(changed)} pages changed)"
+          + (f": {', '.join(rebuilt)}" if rebuilt else ""))
+    return changed
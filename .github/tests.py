@@ -1,7 +1,14 @@
 import subprocess
 import os
+import json
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from importlib.metadata import PackageNotFoundError, version
 from contextlib import contextmanager
+from unittest.mock import patch
 
 
 @contextmanager
@@ -14,6 +21,84 @@ def run_local_pypi_index():
         p.terminate()
 
 
+class RateLimitedAPI(BaseHTTPRequestHandler):
+    # Stand-in for the GitHub API : the first request hits the rate limit, the
+    # next ones get a release listing with a small remaining budget
+    requests = []
+
+    def do_GET(self):
+        self.requests.append((time.time(), self.headers.get("Authorization")))
+        if len(self.requests) == 1:
+            self.send_response(403)
+            self.send_header("Retry-After", "1")
+            self.send_header("X-RateLimit-Remaining", "0")
+            body = b'{"message": "API rate limit exceeded"}'
+        else:
+            self.send_response(200)
+            self.send_header("X-RateLimit-Limit", "60")
+            self.send_header("X-RateLimit-Remaining", "2")
+            self.send_header("X-RateLimit-Reset", str(int(time.time()) + 3))
+            body = json.dumps([{"tag_name": "v0.1", "assets": []}]).encode()
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@contextmanager
+def run_github_api_stand_in():
+    server = ThreadingHTTPServer(("localhost", 0), RateLimitedAPI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield f"http://localhost:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+
+
+def run_rate_limit_tests():
+    # This test is checking that the GitHub API requests wait for the rate
+    # limit instead of failing, against a local stand-in of the API. The
+    # environment and the imported module are restored afterwards, so the
+    # actions run by `run_tests` use the real API.
+    test_dir = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as cache_dir, run_github_api_stand_in() as api_url, \
+            patch.dict(os.environ, PKG_CACHE_DIR=cache_dir, GITHUB_API_URL=api_url, GITHUB_TOKEN="dummy"), \
+            patch.object(sys, "path", [test_dir] + sys.path):
+        try:
+            import download_release
+
+            # The first request is rejected, and retried after `Retry-After`
+            start = time.time()
+            tag, assets = download_release.resolve_release("https://github.com/owner/repo", "0.1")
+            assert tag == "v0.1" and assets == []
+            assert time.time() - start >= 1
+            assert all(auth == "Bearer dummy" for _, auth in RateLimitedAPI.requests)
+
+            # With only 2 requests left before the reset, the next ones are spread
+            assert download_release.RATE_LIMITER.remaining == 2
+            download_release.RELEASE_INDEXES.clear()
+            download_release.resolve_release("https://github.com/owner/repo", "0.1")
+            assert RateLimitedAPI.requests[-1][0] - RateLimitedAPI.requests[-2][0] >= 0.5
+
+            # Spreading the last requests over a reset too far away fails
+            # right away, instead of sleeping silently until the reset
+            download_release.RATE_LIMITER.remaining = 1
+            download_release.RATE_LIMITER.reset = time.time() + 3500
+            download_release.RELEASE_INDEXES.clear()
+            start = time.time()
+            try:
+                download_release.resolve_release("https://github.com/owner/repo", "0.1")
+            except RuntimeError as e:
+                assert "rate limit" in str(e)
+            else:
+                raise AssertionError("The rate limit wait was not capped")
+            assert time.time() - start < 1
+        finally:
+            sys.modules.pop("download_release", None)
+
+
 def exists(pkg_name: str) -> bool:
     try:
         version(pkg_name)
@@ -25,7 +110,7 @@ def exists(pkg_name: str) -> bool:
 
 def pip_install(pkg_name: str, upgrade: bool = False, version: str = None):
     package_to_install = pkg_name if version is None else f"{pkg_name}=={version}"
-    cmd = ["python", "-m", "pip", "install", package_to_install, "--upgrade" if upgrade else "", "--extra-index-url", "http://localhost:8000"]
+    cmd = ["python", "-m", "pip", "install", package_to_install, "--upgrade" if upgrade else "", "--extra-index-url", "http://localhost:8000/simple/"]
     subprocess.run([c for c in cmd if c])
 
 
@@ -106,4 +191,5 @@ def run_tests():
 
 
 if __name__ == "__main__":
+    run_rate_limit_tests()
     run_tests()
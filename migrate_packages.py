@@ -2,17 +2,29 @@
 """
 Migration script to update existing packages to use wheel/tar.gz distribution
 instead of git URLs with egg parameters.
+
+The index state lives in `manifest.json`. Use `--import-html` once to build
+the manifest from the existing HTML pages, and `--backfill` to refresh the
+records (hashes, metadata, sdists...) of the files we already host.
 """
 
+import json
 import os
 import re
+import subprocess
 import sys
-from pathlib import Path
-from bs4 import BeautifulSoup
+from datetime import datetime, timezone
 
 # Add the .github directory to path to import download_release
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '.github'))
 from download_release import download_package_files
+from actions import file_record, normalize, normalize_version, version_record
+from manifest import files_by_name, load_manifest, save_manifest
+from metrics import report
+from render import (
+    INDEX_FILE, PACKAGES_DIR, SIMPLE_DIR, SIMPLE_JSON_FILE, dist_version,
+    render_site
+)
 
 
 def extract_package_info_from_html(package_dir):
@@ -22,6 +34,8 @@ def extract_package_info_from_html(package_dir):
     Returns:
         dict with package_name, homepage, and versions
     """
+    from bs4 import BeautifulSoup  # only needed with --import-html
+
     index_path = os.path.join(package_dir, 'index.html')
     
     with open(index_path, 'r') as f:
@@ -70,111 +84,229 @@ def extract_package_info_from_html(package_dir):
     }
 
 
-def migrate_package(package_dir):
+def migrate_package(manifest, norm_pkg_name):
     """
     Migrate a single package to use wheel/tar.gz distribution.
     """
-    print(f"\nMigrating package: {os.path.basename(package_dir)}")
+    print(f"\nMigrating package: {norm_pkg_name}")
+    package = manifest['packages'][norm_pkg_name]
+    package_output_dir = os.path.join(PACKAGES_DIR, norm_pkg_name)
     
     try:
-        # Extract package information
-        info = extract_package_info_from_html(package_dir)
-        
-        if not info['homepage']:
-            print(f"  ⚠️  No homepage found, skipping")
-            return False
-        
-        package_name = info['package_name']
-        norm_pkg_name = re.sub(r"[-_.]+", "-", package_name).lower()
-        package_output_dir = os.path.join('packages', norm_pkg_name)
-        
         # Process each version
         updated = False
-        for version_info in info['versions']:
-            version = version_info['version']
-            print(f"  Processing version: {version}")
+        for i, version in enumerate(package['versions']):
+            print(f"  Processing version: {version['version']}")
             
             try:
                 # Download package files
+                # The tag the version was found under, when already resolved
                 package_files = download_package_files(
-                    info['homepage'], version, package_name, package_output_dir
+                    package['homepage'], version.get('tag', version['version']),
+                    package['name'], package_output_dir, package.get('source_fetch')
                 )
-                
-                # Update the anchor element
-                anchor = version_info['anchor']
-                base_url = f"../packages/{norm_pkg_name}/"
-                
-                if package_files.get('wheel'):
-                    wheel_filename = os.path.basename(package_files['wheel'])
-                    anchor['href'] = f"{base_url}{wheel_filename}"
-                    anchor['title'] = wheel_filename
-                    print(f"    ✓ Updated to wheel: {wheel_filename}")
-                    updated = True
-                elif package_files.get('tar_gz'):
-                    tar_filename = os.path.basename(package_files['tar_gz'])
-                    anchor['href'] = f"{base_url}{tar_filename}"
-                    anchor['title'] = tar_filename
-                    print(f"    ✓ Updated to tar.gz: {tar_filename}")
-                    updated = True
-                else:
-                    # Update to git URL without egg parameter
-                    current_href = anchor['href']
-                    if '#egg=' in current_href:
-                        new_href = current_href.split('#egg=')[0]
-                        anchor['href'] = new_href
-                        print(f"    ✓ Removed egg parameter from git URL")
-                        updated = True
-                
             except Exception as e:
                 print(f"    ⚠️  Failed to download files: {e}")
-                # Still remove egg parameter
-                current_href = anchor.get('href', '')
-                if '#egg=' in current_href:
-                    new_href = current_href.split('#egg=')[0]
-                    anchor['href'] = new_href
-                    print(f"    ✓ Removed egg parameter from git URL")
-                    updated = True
+                continue
+
+            record = version_record(package, version['version'], package_files)
+            if record['files'] and record != version:
+                # Keep the version shown on the pages
+                record['norm_version'] = version['norm_version']
+                package['versions'][i] = record
+                filenames = ', '.join(file['filename'] for file in record['files'])
+                print(f"    ✓ Updated to {filenames}")
+                updated = True
         
-        # Save updated HTML if changes were made
+        # Save the manifest if changes were made
         if updated:
-            with open(info['index_path'], 'w') as f:
-                f.write(str(info['soup']))
-            print(f"  ✅ Migration complete for {package_name}")
+            save_manifest(manifest)
+            print(f"  ✅ Migration complete for {norm_pkg_name}")
             return True
         else:
-            print(f"  ℹ️  No changes needed for {package_name}")
+            print(f"  ℹ️  No changes needed for {norm_pkg_name}")
             return False
             
     except Exception as e:
-        print(f"  ❌ Error migrating {os.path.basename(package_dir)}: {e}")
+        print(f"  ❌ Error migrating {norm_pkg_name}: {e}")
         return False
 
 
-def main():
+def git_added_time(path):
+    """ Time at which a file was first committed, as a PEP 700 upload-time """
+    output = subprocess.run(
+        ['git', 'log', '--diff-filter=A', '--format=%ct', '--', path],
+        capture_output=True, text=True
+    ).stdout.split()
+    if not output:
+        return None
+    added = datetime.fromtimestamp(int(output[-1]), tz=timezone.utc)
+    return added.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def published_upload_times(norm_pkg_name):
+    """ Upload times already published in the JSON simple API, by filename """
+    json_path = os.path.join(SIMPLE_DIR, norm_pkg_name, SIMPLE_JSON_FILE)
+    if not os.path.exists(json_path):
+        return {}
+    with open(json_path) as f:
+        return {file['filename']: file['upload-time'] for file in json.load(f)['files']}
+
+
+def backfill_package(manifest, norm_pkg_name):
     """
-    Migrate all packages in the repository.
+    Refresh the file records of every version of a package from the files
+    already stored in ``packages/``, without any download. The other files we
+    host for the same version (the sdist of a wheel for example) are added.
     """
-    print("🚀 Starting package migration to wheel/tar.gz distribution\n")
-    
-    # Find all package directories
+    print(f"\nBackfilling package: {norm_pkg_name}")
+    package = manifest['packages'][norm_pkg_name]
+    files_dir = os.path.join(PACKAGES_DIR, norm_pkg_name)
+    hosted = sorted(
+        filename for filename in os.listdir(files_dir)
+        if filename.endswith(('.whl', '.tar.gz'))
+    ) if os.path.isdir(files_dir) else []
+    known_files = files_by_name(package)
+
+    updated = False
+    for version in package['versions']:
+        if not version['files']:
+            continue
+
+        versions = {dist_version(file['filename']) for file in version['files']}
+        filenames = [filename for filename in hosted if dist_version(filename) in versions]
+        for file in version['files']:
+            if file['filename'] not in hosted:
+                print(f"  ⚠️  Missing file {file['filename']}")
+
+        files = []
+        for filename in sorted(filenames, key=lambda f: (not f.endswith('.whl'), f)):
+            path = os.path.join(files_dir, filename)
+            upload_time = known_files.get(filename, {}).get('upload_time') or git_added_time(path)
+            files.append(file_record(path, upload_time=upload_time))
+        if files != version['files']:
+            version['files'] = files
+            updated = True
+
+    if updated:
+        print(f"  ✅ Files refreshed")
+    else:
+        print(f"  ℹ️  No changes needed")
+    return updated
+
+
+def import_package_from_html(package_dir, index_soup):
+    """
+    Build the manifest record of a package from its (legacy) HTML pages.
+    """
+    info = extract_package_info_from_html(package_dir)
+    norm_pkg_name = os.path.basename(package_dir)
+    upload_times = published_upload_times(norm_pkg_name)
+
+    card = index_soup.find('a', attrs={'href': f"{norm_pkg_name}/"})
+    short_desc = card.find('span', class_='description').get_text().strip() if card else ""
+    author = info['soup'].find('p', class_='elem')
+    author = author.get_text().replace('Author :', '').strip() if author else ""
+
+    versions = []
+    for version_info in info['versions']:
+        files = []
+        for anchor in version_info['div'].find_all('a'):
+            href = anchor.get('href', '')
+            if not href.startswith(f"../{PACKAGES_DIR}/"):
+                continue
+            path = href[len('../'):].split('#')[0]
+            if not os.path.exists(path):
+                print(f"  ⚠️  Missing file {path}")
+                continue
+            filename = os.path.basename(path)
+            upload_time = upload_times.get(filename) or git_added_time(path)
+            files.append(file_record(path, upload_time=upload_time))
+        versions.append({
+            'version': version_info['version'],
+            'norm_version': version_info['anchor'].get_text().strip()
+                or normalize_version(version_info['version']),
+            'files': files,
+        })
+
+    return {
+        'name': info['package_name'],
+        'author': author,
+        'short_desc': short_desc,
+        'homepage': info['homepage'],
+        'versions': versions,
+    }
+
+
+def import_manifest_from_html():
+    """
+    Build `manifest.json` from the existing HTML pages, for the packages that
+    are not in it yet.
+    """
+    from bs4 import BeautifulSoup  # only needed with --import-html
+
+    manifest = load_manifest()
+    with open(INDEX_FILE) as f:
+        index_soup = BeautifulSoup(f, 'html.parser')
+
+    for package_dir in find_package_dirs():
+        norm_pkg_name = normalize(package_dir)
+        if norm_pkg_name in manifest['packages']:
+            continue
+        print(f"Importing package: {norm_pkg_name}")
+        manifest['packages'][norm_pkg_name] = import_package_from_html(package_dir, index_soup)
+
+    save_manifest(manifest)
+    return manifest
+
+
+def find_package_dirs():
     package_dirs = []
-    for item in os.listdir('.'):
+    for item in sorted(os.listdir('.')):
         if os.path.isdir(item) and os.path.exists(os.path.join(item, 'index.html')):
             # Skip special directories
-            if item not in ['.git', '.github', 'static', 'packages']:
+            if item not in ['.git', '.github', 'static', 'packages', 'simple']:
                 package_dirs.append(item)
+    return package_dirs
+
+
+def main():
+    """
+    Migrate all packages in the repository.
+    """
+    if '--import-html' in sys.argv[1:]:
+        import_manifest_from_html()
+
+    manifest = load_manifest()
+    if '--backfill' in sys.argv[1:]:
+        # Only refresh the records of the files we already host
+        for norm_pkg_name in sorted(manifest['packages']):
+            if backfill_package(manifest, norm_pkg_name):
+                save_manifest(manifest)
+        render_site(manifest)
+        report()
+        return
+    if '--import-html' in sys.argv[1:]:
+        return
+
+    print("🚀 Starting package migration to wheel/tar.gz distribution\n")
+    
+    # Find all packages
+    packages = sorted(manifest['packages'])
     
-    print(f"Found {len(package_dirs)} packages to migrate: {', '.join(package_dirs)}")
+    print(f"Found {len(packages)} packages to migrate: {', '.join(packages)}")
     
     # Migrate each package
     success_count = 0
-    for package_dir in package_dirs:
-        if migrate_package(package_dir):
+    for norm_pkg_name in packages:
+        if migrate_package(manifest, norm_pkg_name):
             success_count += 1
     
-    print(f"\n✅ Migration complete! Successfully migrated {success_count}/{len(package_dirs)} packages")
+    render_site(manifest)
+    report()
+    print(f"\n✅ Migration complete! Successfully migrated {success_count}/{len(packages)} packages")
     
-    if success_count < len(package_dirs):
+    if success_count < len(packages):
         print("\n⚠️  Some packages could not be fully migrated. They will continue to work with git URLs.")
     
     print("\n📝 Next steps:")
@@ -184,4 +316,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
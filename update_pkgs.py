@@ -2,32 +2,22 @@
 import os
 import sys
 sys.path.append(os.path.join(os.path.dirname(__file__), ".github"))
-from actions import main as github_action
+from actions import run_batch
 
 def execute_main(pkg_name, versions, short_desc, homepage):
-    # Delete
-    os.environ["PKG_ACTION"] = "DELETE"
-    os.environ["PKG_NAME"] = pkg_name
-    github_action()
-    print(f"Package {pkg_name} deleted")
-    
-    # Register
-    os.environ["PKG_ACTION"] = "REGISTER"
-    os.environ["PKG_NAME"] = pkg_name
-    os.environ["PKG_VERSION"] = versions[0]
-    os.environ["PKG_AUTHOR"] = "Nicolas Remond"
-    os.environ["PKG_SHORT_DESC"] = short_desc
-    os.environ["PKG_HOMEPAGE"] = homepage
-    github_action()
-    print(f"Package {pkg_name} registered")
-    
-    # Update
+    # Delete, register the first version and add the others, in one batch
+    operations = [{"action": "DELETE", "pkg_name": pkg_name}]
+    operations.append({
+        "action": "REGISTER",
+        "pkg_name": pkg_name,
+        "version": versions[0],
+        "author": "Nicolas Remond",
+        "short_desc": short_desc,
+        "homepage": homepage,
+    })
     for version in versions[1:]:
-        os.environ["PKG_ACTION"] = "UPDATE"
-        os.environ["PKG_NAME"] = pkg_name
-        os.environ["PKG_VERSION"] = version
-        github_action()
-        print(f"Package {pkg_name} updated to version {version}")
+        operations.append({"action": "UPDATE", "pkg_name": pkg_name, "version": version})
+    run_batch(operations)
     print(f"Package {pkg_name} done")
 
 